@@ -0,0 +1,76 @@
+"""
+Аутентификация по токену с кэшем. Токен вместе с пользователем хранится
+в кэше процесса TOKEN_CACHE_TTL секунд, а при заданном
+TOKEN_CACHE_SHARED_TTL и общем кэше default ещё и в нём. Удаление
+токена и сохранение пользователя (смена пароля, блокировка) удаляют
+записи из общего кэша и кэша текущего процесса; в других процессах
+запись живёт не дольше TOKEN_CACHE_TTL. Кэш default процесса общим не
+считается: он не видит удалений из других процессов.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .cache import is_shared
+
+
+def token_key(key):
+    """В кэш не попадает сам токен, только его хэш."""
+    return f'token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def get_shared_ttl():
+    return settings.TOKEN_CACHE_SHARED_TTL if is_shared() else None
+
+
+def get_token(key):
+    cache_key = token_key(key)
+    local = caches['local']
+    token = local.get(cache_key)
+    if token is not None:
+        return token
+    shared_ttl = get_shared_ttl()
+    if shared_ttl:
+        token = cache.get(cache_key)
+    if token is None:
+        token = Token.objects.select_related('user').filter(key=key).first()
+        if token is None:
+            return None
+        if shared_ttl:
+            cache.set(cache_key, token, timeout=shared_ttl)
+    local.set(cache_key, token, timeout=settings.TOKEN_CACHE_TTL)
+    return token
+
+
+def invalidate(*keys):
+    cache_keys = [token_key(key) for key in keys]
+    if not cache_keys:
+        return
+    caches['local'].delete_many(cache_keys)
+    if get_shared_ttl():
+        cache.delete_many(cache_keys)
+
+
+def invalidate_user(user_id):
+    keys = list(Token.objects.filter(user_id=user_id).values_list(
+        'key', flat=True))
+    transaction.on_commit(lambda: invalidate(*keys))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса к БД при попадании в кэш."""
+
+    def authenticate_credentials(self, key):
+        token = get_token(key)
+        if token is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.'))
+        return token.user, token
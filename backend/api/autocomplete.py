@@ -0,0 +1,56 @@
+import threading
+from bisect import bisect_left
+
+from recipe.models import Ingredient
+
+from .cache import get_version
+
+
+class IngredientIndex:
+    """
+    Индекс ингредиентов в памяти процесса для автодополнения.
+    Хранит отсортированные названия в нижнем регистре; перестраивается,
+    когда меняется версия справочника ингредиентов.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = (None, [], [])
+
+    def _build(self):
+        entries = sorted(
+            (name.lower(), pk, {'id': pk,
+                                'name': name,
+                                'measurement_unit': measurement_unit})
+            for pk, name, measurement_unit
+            in Ingredient.objects.values_list('id', 'name',
+                                              'measurement_unit').iterator()
+        )
+        return ([name for name, _, _ in entries],
+                [item for _, _, item in entries])
+
+    def load(self):
+        version = get_version(Ingredient)
+        if self._state[0] != version:
+            with self._lock:
+                if self._state[0] != version:
+                    self._state = (version, *self._build())
+        return self._state[1:]
+
+    def search(self, value, limit):
+        """Сначала совпадения по началу названия, затем по подстроке."""
+        names, items = self.load()
+        value = value.lower()
+        result = []
+        for index in range(bisect_left(names, value), len(names)):
+            if len(result) >= limit or not names[index].startswith(value):
+                break
+            result.append(items[index])
+        for name, item in zip(names, items):
+            if len(result) >= limit:
+                break
+            if value in name and not name.startswith(value):
+                result.append(item)
+        return result
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,233 @@
+"""
+Сценарии нагрузочных замеров API через тестовый клиент Django.
+Каждый сценарий - функция (client, random) -> response.
+Сценарии чтения также прогоняются параллельными клиентами через
+WSGI- и ASGI-обработчик для сравнения пропускной способности.
+"""
+import asyncio
+import base64
+import inspect
+import io
+import random
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from statistics import mean
+
+from django.db import connections, transaction
+from django.test import AsyncClient, Client
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from recipe.models import Ingredient, Recipe, Tag
+
+from .metrics import Histogram
+
+SCENARIOS = {}
+READ_SCENARIOS = ('recipe_list', 'recipe_filter', 'recipe_search',
+                  'recipe_retrieve', 'subscriptions')
+
+
+def scenario(func):
+    SCENARIOS[func.__name__] = func
+    return func
+
+
+class ScenarioData:
+
+    def load(self, user):
+        self.user = user
+        self.token, _ = Token.objects.get_or_create(user=user)
+        self.recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+        self.tag_slugs = list(Tag.objects.values_list('slug', flat=True))
+        self.ingredient_ids = list(
+            Ingredient.objects.values_list('id', flat=True))
+
+
+class BenchmarkClient(ScenarioData, Client):
+
+    def __init__(self, user, **defaults):
+        self.load(user)
+        super().__init__(HTTP_AUTHORIZATION=f'Token {self.token.key}',
+                         **defaults)
+
+
+class AsyncBenchmarkClient(ScenarioData, AsyncClient):
+
+    def __init__(self, user, **defaults):
+        self.load(user)
+        super().__init__(**defaults)
+
+    def generic(self, *args, **extra):
+        extra.setdefault('authorization', f'Token {self.token.key}')
+        return super().generic(*args, **extra)
+
+
+@scenario
+def recipe_list(client, rnd):
+    return client.get('/api/recipes/', {'page': rnd.randint(1, 5)})
+
+
+@scenario
+def recipe_filter(client, rnd):
+    return client.get('/api/recipes/', {
+        'tags': rnd.sample(client.tag_slugs, min(2, len(client.tag_slugs))),
+        'is_favorited': rnd.choice((0, 1)),
+    })
+
+
+@scenario
+def recipe_search(client, rnd):
+    return client.get('/api/recipes/', {'search': rnd.choice(
+        ('суп', 'салат', 'пирог', 'курица грибы', 'сыр'))})
+
+
+@scenario
+def recipe_retrieve(client, rnd):
+    return client.get(f'/api/recipes/{rnd.choice(client.recipe_ids)}/')
+
+
+@scenario
+def subscriptions(client, rnd):
+    return client.get('/api/users/subscriptions/', {'recipes_limit': 3})
+
+
+@scenario
+def download_shopping_cart(client, rnd):
+    response = client.get('/api/recipes/download_shopping_cart/')
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return response
+
+
+def sample_image():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), (200, 120, 40)).save(buffer, 'PNG')
+    return ('data:image/png;base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
+
+
+@scenario
+def recipe_create(client, rnd):
+    """Создание откатывается, чтобы прогоны не меняли данные."""
+    data = {
+        'name': f'Замер {rnd.getrandbits(64):x}',
+        'text': 'Синтетический рецепт',
+        'cooking_time': rnd.randint(5, 120),
+        'image': sample_image(),
+        'tags': [Tag.objects.values_list('id', flat=True).first()],
+        'ingredients': [
+            {'id': pk, 'amount': rnd.randint(1, 500)}
+            for pk in rnd.sample(client.ingredient_ids,
+                                 min(8, len(client.ingredient_ids)))
+        ],
+    }
+    with transaction.atomic():
+        response = client.post('/api/recipes/', data,
+                               content_type='application/json')
+        transaction.set_rollback(True)
+    return response
+
+
+def measure(client, func, rnd):
+    start = time.perf_counter()
+    response = func(client, rnd)
+    elapsed = (time.perf_counter() - start) * 1000
+    metrics = getattr(response.wsgi_request, 'metrics', None)
+    return response.status_code, elapsed, getattr(metrics, 'queries', None)
+
+
+def summary(values):
+    values = sorted(values)
+    return {
+        'p50': round(Histogram.percentile(values, 50), 2),
+        'p95': round(Histogram.percentile(values, 95), 2),
+        'p99': round(Histogram.percentile(values, 99), 2),
+        'max': round(values[-1], 2),
+        'mean': round(mean(values), 2),
+    }
+
+
+def run(client, name, requests, warmup, rnd):
+    func = SCENARIOS[name]
+    for _ in range(warmup):
+        measure(client, func, rnd)
+    results = [measure(client, func, rnd) for _ in range(requests)]
+    tracemalloc.start()
+    try:
+        measure(client, func, rnd)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    statuses, latencies, queries = zip(*results)
+    report = {
+        'requests': requests,
+        'status': dict(Counter(statuses)),
+        'latency_ms': summary(latencies),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+    if None not in queries:
+        report['queries'] = summary(queries)
+    return report
+
+
+def wsgi_throughput(user, name, concurrency, requests, seed):
+    """Потоки с синхронным клиентом: как sync-воркеры WSGI-сервера."""
+    func = SCENARIOS[name]
+
+    def worker(index):
+        client = BenchmarkClient(user)
+        rnd = random.Random(seed + index)
+        try:
+            return [measure(client, func, rnd)[:2]
+                    for _ in range(requests // concurrency)]
+        finally:
+            connections.close_all()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = [row for rows in pool.map(worker, range(concurrency))
+                   for row in rows]
+    return results, time.perf_counter() - start
+
+
+def asgi_throughput(user, name, concurrency, requests, seed):
+    """Конкурентные задачи asyncio с AsyncClient через ASGIHandler."""
+    func = SCENARIOS[name]
+    clients = [AsyncBenchmarkClient(user) for _ in range(concurrency)]
+
+    async def worker(client, rnd):
+        rows = []
+        for _ in range(requests // concurrency):
+            start = time.perf_counter()
+            response = func(client, rnd)
+            if inspect.isawaitable(response):
+                response = await response
+            rows.append((response.status_code,
+                         (time.perf_counter() - start) * 1000))
+        return rows
+
+    async def main():
+        return await asyncio.gather(*(
+            worker(client, random.Random(seed + index))
+            for index, client in enumerate(clients)))
+
+    start = time.perf_counter()
+    results = [row for rows in asyncio.run(main()) for row in rows]
+    return results, time.perf_counter() - start
+
+
+def throughput(user, name, concurrency, requests, seed):
+    report = {}
+    for interface, runner in (('wsgi', wsgi_throughput),
+                              ('asgi', asgi_throughput)):
+        results, elapsed = runner(user, name, concurrency, requests, seed)
+        statuses, latencies = zip(*results)
+        report[interface] = {
+            'requests': len(results),
+            'status': dict(Counter(statuses)),
+            'rps': round(len(results) / elapsed, 1),
+            'latency_ms': summary(latencies),
+        }
+    return report
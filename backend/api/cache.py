@@ -0,0 +1,77 @@
+import time
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from recipe.models import DataVersion
+
+
+# Бэкенды, у которых кэш общий для всех процессов и серверов
+SHARED_BACKENDS = ('memcached', 'redis', 'DatabaseCache')
+
+
+def is_shared(alias=DEFAULT_CACHE_ALIAS):
+    backend = settings.CACHES[alias]['BACKEND']
+    return any(name in backend for name in SHARED_BACKENDS)
+
+
+def version_key(model):
+    return f'version:{model._meta.label_lower}'
+
+
+def new_version():
+    return f'{time.time_ns():x}'
+
+
+def get_version_timeout():
+    """
+    В общем кэше версия хранится без таймаута. Кэш процесса не видит
+    изменений из других процессов, поэтому версия в нём перечитывается
+    из БД раз в VERSION_LOCAL_TTL секунд.
+    """
+    return None if is_shared() else settings.VERSION_LOCAL_TTL
+
+
+def get_versions(*models):
+    """
+    Версии данных моделей: время последнего изменения в наносекундах.
+    Меняются только при изменении модели: с новой версией остывают все
+    зависящие от неё записи кэша. Недостающие в кэше читаются из БД
+    одним запросом.
+    """
+    keys = {model: version_key(model) for model in models}
+    cached = cache.get_many(keys.values())
+    missing = {model._meta.label_lower: model for model, key in keys.items()
+               if key not in cached}
+    if missing:
+        # Читаются с основной БД: реплика может отставать от bump_version
+        queryset = DataVersion.objects.using(DEFAULT_DB_ALIAS)
+        versions = dict(queryset.filter(
+            label__in=missing).values_list('label', 'version'))
+        for label, model in missing.items():
+            if label not in versions:
+                versions[label] = queryset.get_or_create(
+                    label=label,
+                    defaults={'version': new_version()})[0].version
+            # add не затирает версию, записанную bump_version после чтения
+            cache.add(keys[model], versions[label],
+                      timeout=get_version_timeout())
+            cached[keys[model]] = versions[label]
+    return [cached[keys[model]] for model in models]
+
+
+def get_version(model):
+    return get_versions(model)[0]
+
+
+def bump_version(model):
+    version = new_version()
+    DataVersion.objects.update_or_create(
+        label=model._meta.label_lower, defaults={'version': version})
+    transaction.on_commit(lambda: cache.set(
+        version_key(model), version, timeout=get_version_timeout()))
+
+
+def version_timestamp(version):
+    return int(version, 16) / 10 ** 9
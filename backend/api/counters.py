@@ -0,0 +1,55 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipe.models import Favorites, Recipe
+from users.models import Subscriptions
+
+User = get_user_model()
+
+# (модель, поле счётчика, считаемая модель, её ссылка на модель)
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorites, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Subscriptions, 'author'),
+)
+
+
+def update_counter(model, pk, field, delta):
+    """Атомарно изменяет счётчик на delta, не опуская его ниже нуля."""
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def update_counters(model, pks, field, delta):
+    """update_counter для нескольких строк одним UPDATE."""
+    queryset = model.objects.filter(pk__in=pks)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def actual_count(related_model, related_field):
+    return Coalesce(Subquery(
+        related_model.objects.filter(
+            **{related_field: OuterRef('pk')}
+        ).order_by().values(related_field).annotate(
+            total=Count('pk')
+        ).values('total')
+    ), 0)
+
+
+def stale_rows(model, field, related_model, related_field):
+    """Строки, в которых счётчик расходится с фактическим количеством."""
+    return model.objects.annotate(
+        actual=actual_count(related_model, related_field)
+    ).exclude(**{field: F('actual')})
+
+
+def reconcile(model, field, related_model, related_field):
+    return model.objects.filter(
+        pk__in=stale_rows(model, field, related_model,
+                          related_field).values('pk')
+    ).update(**{field: actual_count(related_model, related_field)})
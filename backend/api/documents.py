@@ -0,0 +1,106 @@
+"""
+Кэш документов рецептов: всё, что одинаково для любого пользователя
+(автор, теги, ингредиенты, картинки, текст). Документ хранится вместе с
+версией, в которую входят версии справочников тегов и ингредиентов и
+версия самого рецепта. Версия рецепта меняется после коммита любой
+записи в рецепт, его ингредиенты, теги или данные автора. Версия
+читается до сборки документа, поэтому документ, собранный из данных до
+записи, не совпадёт с новой версией, даже если попал в кэш после неё.
+Флаги is_favorited, is_in_shopping_cart и author.is_subscribed
+добавляются при ответе. Документы кэшируются только в общем кэше:
+версии в кэше процесса не видят записей из других процессов. Документы,
+собранные с реплики, в кэш не попадают: реплика может отставать.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from recipe.models import Ingredient, Recipe, Tag
+
+from . import replicas
+from .cache import get_versions, is_shared, new_version
+
+# Поля автора, которые попадают в документ
+AUTHOR_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+
+def document_key(pk):
+    return f'recipe:document:{pk}'
+
+
+def version_key(pk):
+    return f'recipe:version:{pk}'
+
+
+def get_documents_version():
+    return ':'.join(get_versions(Tag, Ingredient))
+
+
+def get_recipe_versions(pks, cached):
+    """
+    Версии рецептов из уже прочитанных cached. Отсутствующие создаются
+    через add, чтобы параллельные запросы получили одну и ту же версию.
+    """
+    keys = {pk: version_key(pk) for pk in pks}
+    missing = [key for key in keys.values() if key not in cached]
+    if missing:
+        for key in missing:
+            cache.add(key, new_version(), timeout=None)
+        cached = {**cached, **cache.get_many(missing)}
+    return {pk: cached.get(key) for pk, key in keys.items()}
+
+
+def get_many(pks, build):
+    """
+    Документы рецептов в порядке pks. Отсутствующие в кэше или
+    устаревшие собирает build(pks) одним проходом и кладёт в кэш.
+    """
+    if not is_shared():
+        documents = {document['id']: document for document in build(pks)}
+        return [documents[pk] for pk in pks if pk in documents]
+    documents_version = get_documents_version()
+    keys = {pk: document_key(pk) for pk in pks}
+    cached = cache.get_many([*keys.values(), *map(version_key, pks)])
+    versions = {
+        pk: f'{documents_version}:{recipe_version}'
+        for pk, recipe_version in get_recipe_versions(pks, cached).items()
+    }
+    documents = {}
+    for pk, key in keys.items():
+        item = cached.get(key)
+        if item is not None and item[0] == versions[pk]:
+            documents[pk] = item[1]
+    missing = [pk for pk in keys if pk not in documents]
+    if missing:
+        built = {document['id']: document for document in build(missing)}
+        documents.update(built)
+        # Внутри транзакции данные могут откатиться вместе с id рецепта
+        if (built and not connection.in_atomic_block
+                and replicas.read_alias.get() is None):
+            cache.set_many(
+                {keys[pk]: (versions[pk], document)
+                 for pk, document in built.items()},
+                timeout=settings.RECIPE_DOCUMENT_TTL)
+    return [documents[pk] for pk in pks if pk in documents]
+
+
+def invalidate(*pks):
+    """Новые версии рецептов после коммита: их документы устаревают."""
+    if pks and is_shared():
+        transaction.on_commit(lambda: cache.set_many(
+            {version_key(pk): new_version() for pk in pks}, timeout=None))
+
+
+def remove(pk):
+    """Документ и версия удалённого рецепта больше не нужны."""
+    if not is_shared():
+        return
+    transaction.on_commit(lambda: cache.delete_many(
+        [document_key(pk), version_key(pk)]))
+
+
+def invalidate_author(author_id):
+    if not is_shared():
+        return
+    invalidate(*Recipe.objects.filter(author_id=author_id).values_list(
+        'id', flat=True))
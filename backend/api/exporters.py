@@ -0,0 +1,386 @@
+import csv
+import hashlib
+import io
+import os
+import zlib
+from datetime import datetime
+from functools import lru_cache
+
+from django.http import StreamingHttpResponse
+from fontTools import subset
+from fontTools.ttLib import TTFont
+
+
+class ShoppingListExporter:
+    """
+    Потоковая выгрузка списка покупок.
+    Строки читаются из БД курсором и отдаются клиенту частями. С prefetch
+    строки читаются заранее: ASGIHandler перебирает потоковый ответ в
+    цикле событий, где запросы к БД запрещены.
+    """
+    extension = None
+    content_type = None
+    chunk_size = 500
+
+    def __init__(self, user, ingredients, prefetch=False):
+        self.user = user
+        self.ingredients = ingredients
+        self.rows = list(ingredients) if prefetch else None
+        self.today = datetime.today()
+
+    def get_filename(self):
+        return f'{self.user.username}_shopping_list.{self.extension}'
+
+    def get_rows(self):
+        if self.rows is not None:
+            return self.rows
+        return self.ingredients.iterator(chunk_size=self.chunk_size)
+
+    def get_header(self):
+        return [
+            f'Список покупок для: {self.user.get_full_name()}',
+            f'Дата: {self.today:%Y-%m-%d}',
+            '',
+        ]
+
+    def get_footer(self):
+        return ['', f'Foodgram ({self.today:%Y})']
+
+    @staticmethod
+    def format_row(row):
+        return (f'- {row["ingredient__name"]} '
+                f'({row["ingredient__measurement_unit"]})'
+                f' - {row["amount"]}')
+
+    def get_lines(self):
+        yield from self.get_header()
+        for row in self.get_rows():
+            yield self.format_row(row)
+        yield from self.get_footer()
+
+    def batched(self, items):
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= self.chunk_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def stream(self):
+        raise NotImplementedError
+
+    def get_response(self):
+        response = StreamingHttpResponse(self.stream(),
+                                         content_type=self.content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename={self.get_filename()}')
+        return response
+
+
+class TxtExporter(ShoppingListExporter):
+    """Выгрузка в текстовый файл."""
+    extension = 'txt'
+    content_type = 'text/plain; charset=utf-8'
+
+    def stream(self):
+        yield ''.join(f'{line}\n' for line in self.get_header()).encode()
+        rows = (self.format_row(row) for row in self.get_rows())
+        for batch in self.batched(rows):
+            yield ''.join(f'{line}\n' for line in batch).encode()
+        yield '\n'.join(self.get_footer()).encode()
+
+
+class Echo:
+    """Буфер для csv.writer, возвращающий записанную строку."""
+    @staticmethod
+    def write(value):
+        return value
+
+
+class CsvExporter(ShoppingListExporter):
+    """Выгрузка в CSV."""
+    extension = 'csv'
+    content_type = 'text/csv; charset=utf-8'
+    columns = ('Ингредиент', 'Единицы измерения', 'Количество')
+
+    def stream(self):
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.columns).encode()
+        rows = (
+            (row['ingredient__name'], row['ingredient__measurement_unit'],
+             row['amount'])
+            for row in self.get_rows()
+        )
+        for batch in self.batched(rows):
+            yield ''.join(writer.writerow(row) for row in batch).encode()
+
+
+FONT_PATH = os.path.join(os.path.dirname(__file__), 'fonts',
+                         'DejaVuSansMono.ttf')
+
+
+class PdfFont:
+    """
+    Шрифт TrueType с кириллицей. Текст в PDF пишется номерами глифов,
+    в документ встраивается только подмножество использованных глифов.
+    """
+
+    def __init__(self, path=FONT_PATH):
+        with open(path, 'rb') as file:
+            self.data = file.read()
+        font = TTFont(io.BytesIO(self.data))
+        scale = 1000 / font['head'].unitsPerEm
+        self.name = font['name'].getDebugName(6)
+        self.glyphs = {code: font.getGlyphID(name)
+                       for code, name in font.getBestCmap().items()}
+        self.widths = [round(font['hmtx'][name][0] * scale)
+                       for name in font.getGlyphOrder()]
+        head, hhea = font['head'], font['hhea']
+        self.bbox = [round(value * scale) for value in (
+            head.xMin, head.yMin, head.xMax, head.yMax)]
+        self.ascent = round(hhea.ascent * scale)
+        self.descent = round(hhea.descent * scale)
+        self.fixed_pitch = bool(font['post'].isFixedPitch)
+
+    def glyph(self, char):
+        return self.glyphs.get(ord(char), 0)
+
+    def text_width(self, text, size):
+        return sum(self.widths[self.glyph(char)]
+                   for char in text) * size / 1000
+
+    def subset(self, glyphs):
+        """Номера глифов сохраняются: ими уже записаны страницы."""
+        font = TTFont(io.BytesIO(self.data))
+        options = subset.Options()
+        options.retain_gids = True
+        options.notdef_outline = True
+        options.drop_tables += ['FFTM']
+        subsetter = subset.Subsetter(options)
+        subsetter.populate(gids=sorted(glyphs))
+        subsetter.subset(font)
+        buffer = io.BytesIO()
+        font.save(buffer)
+        return buffer.getvalue()
+
+
+@lru_cache(maxsize=None)
+def get_font():
+    return PdfFont()
+
+
+class PdfWriter:
+    """
+    Минимальный PDF, который пишется постранично.
+    Каталог, дерево страниц, шрифт и таблица xref пишутся в конце,
+    в памяти хранятся только смещения объектов и номера глифов.
+    """
+    (CATALOG_ID, PAGES_ID, FONT_ID, TO_UNICODE_ID, CID_FONT_ID,
+     DESCRIPTOR_ID, FONT_FILE_ID) = range(1, 8)
+
+    def __init__(self, width, height, font=None):
+        self.width = width
+        self.height = height
+        self.font = font or get_font()
+        self.chars = {0: None}
+        self.offset = 0
+        self.offsets = {}
+        self.pages = []
+        self.next_id = self.FONT_FILE_ID + 1
+
+    def _write(self, data):
+        self.offset += len(data)
+        return data
+
+    def _object(self, obj_id, body):
+        self.offsets[obj_id] = self.offset
+        return self._write(b'%d 0 obj\n%s\nendobj\n' % (obj_id, body))
+
+    def _stream(self, obj_id, data, **entries):
+        entries = b''.join(b' /%s %s' % (key.encode(), value)
+                           for key, value in entries.items())
+        return self._object(
+            obj_id, b'<< /Length %d%s >>\nstream\n%s\nendstream'
+            % (len(data), entries, data))
+
+    def encode(self, text):
+        """Строка PDF из номеров глифов (кодировка Identity-H)."""
+        glyphs = []
+        for char in text:
+            glyph = self.font.glyph(char)
+            self.chars.setdefault(glyph, char)
+            glyphs.append(b'%04X' % glyph)
+        return b'<%s>' % b''.join(glyphs)
+
+    def header(self):
+        return self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def page(self, content):
+        content_id, page_id = self.next_id, self.next_id + 1
+        self.next_id += 2
+        self.pages.append(page_id)
+        content_obj = self._stream(content_id, content)
+        page_obj = self._object(
+            page_id,
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] '
+            b'/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>'
+            % (self.PAGES_ID, self.width, self.height, self.FONT_ID,
+               content_id))
+        return content_obj + page_obj
+
+    def font_name(self):
+        """Имя подмножества: шесть заглавных букв, '+' и имя шрифта."""
+        digest = hashlib.md5(repr(sorted(self.chars)).encode()).digest()
+        tag = bytes(ord('A') + byte % 26 for byte in digest[:6])
+        return b'%s+%s' % (tag, self.font.name.encode())
+
+    def fonts(self):
+        name = self.font_name()
+        widths = b' '.join(b'%d [%d]' % (glyph, self.font.widths[glyph])
+                           for glyph in sorted(self.chars))
+        font_file = self.font.subset(self.chars)
+        flags = 4 | self.font.fixed_pitch
+        return (
+            self._object(
+                self.FONT_ID,
+                b'<< /Type /Font /Subtype /Type0 /BaseFont /%s '
+                b'/Encoding /Identity-H /DescendantFonts [%d 0 R] '
+                b'/ToUnicode %d 0 R >>'
+                % (name, self.CID_FONT_ID, self.TO_UNICODE_ID))
+            + self._stream(self.TO_UNICODE_ID, self.to_unicode())
+            + self._object(
+                self.CID_FONT_ID,
+                b'<< /Type /Font /Subtype /CIDFontType2 /BaseFont /%s '
+                b'/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) '
+                b'/Supplement 0 >> /FontDescriptor %d 0 R '
+                b'/CIDToGIDMap /Identity /W [%s] >>'
+                % (name, self.DESCRIPTOR_ID, widths))
+            + self._object(
+                self.DESCRIPTOR_ID,
+                b'<< /Type /FontDescriptor /FontName /%s /Flags %d '
+                b'/FontBBox [%s] /ItalicAngle 0 /Ascent %d /Descent %d '
+                b'/CapHeight %d /StemV 80 /FontFile2 %d 0 R >>'
+                % (name, flags,
+                   b' '.join(b'%d' % value for value in self.font.bbox),
+                   self.font.ascent, self.font.descent, self.font.ascent,
+                   self.FONT_FILE_ID))
+            + self._stream(self.FONT_FILE_ID, zlib.compress(font_file),
+                           Length1=b'%d' % len(font_file),
+                           Filter=b'/FlateDecode')
+        )
+
+    def to_unicode(self):
+        chars = [(glyph, char) for glyph, char in sorted(self.chars.items())
+                 if char is not None]
+        blocks = b''.join(
+            b'%d beginbfchar\n%s\nendbfchar\n' % (
+                len(block),
+                b'\n'.join(b'<%04X> <%s>'
+                           % (glyph, char.encode('utf-16-be').hex().encode())
+                           for glyph, char in block))
+            for block in (chars[i:i + 100] for i in range(0, len(chars), 100))
+        )
+        return (b'/CIDInit /ProcSet findresource begin\n'
+                b'12 dict begin\nbegincmap\n'
+                b'/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) '
+                b'/Supplement 0 >> def\n'
+                b'/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n'
+                b'1 begincodespacerange\n<0000> <FFFF>\nendcodespacerange\n'
+                b'%s'
+                b'endcmap\nCMapName currentdict /CMap defineresource pop\n'
+                b'end\nend' % blocks)
+
+    def trailer(self):
+        kids = b' '.join(b'%d 0 R' % page_id for page_id in self.pages)
+        data = (
+            self.fonts()
+            + self._object(self.PAGES_ID,
+                           b'<< /Type /Pages /Kids [%s] /Count %d >>'
+                           % (kids, len(self.pages)))
+            + self._object(self.CATALOG_ID,
+                           b'<< /Type /Catalog /Pages %d 0 R >>'
+                           % self.PAGES_ID)
+        )
+        xref_offset = self.offset
+        xref = b'xref\n0 %d\n0000000000 65535 f \n' % self.next_id
+        xref += b''.join(b'%010d 00000 n \n' % self.offsets[obj_id]
+                         for obj_id in range(1, self.next_id))
+        return data + xref + (
+            b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+            % (self.next_id, self.CATALOG_ID, xref_offset))
+
+
+class PdfExporter(ShoppingListExporter):
+    """Выгрузка в PDF: каждая страница отдаётся сразу после заполнения."""
+    extension = 'pdf'
+    content_type = 'application/pdf'
+    page_width = 595
+    page_height = 842
+    margin = 56
+    font_size = 11
+    leading = 15
+    indent = '  '
+
+    def get_lines_per_page(self):
+        return (self.page_height - 2 * self.margin) // self.leading
+
+    def wrap(self, font, line):
+        """Переносит строку по словам, чтобы она не выходила за поля."""
+        max_width = self.page_width - 2 * self.margin
+
+        def fits(text):
+            return font.text_width(text, self.font_size) <= max_width
+
+        lines, current = [], ''
+        for word in line.split(' '):
+            candidate = f'{current} {word}' if current else word
+            # Слово длиннее строки не переносится целиком, а режется
+            if not current or fits(candidate) or not fits(self.indent + word):
+                current = candidate
+                continue
+            lines.append(current)
+            current = self.indent + word
+        lines.append(current)
+        return [part for text in lines
+                for part in self.split_long(font, text, max_width)]
+
+    def split_long(self, font, text, max_width):
+        while font.text_width(text, self.font_size) > max_width:
+            cut = len(text) - 1
+            while cut > len(self.indent) + 1 and font.text_width(
+                    text[:cut], self.font_size) > max_width:
+                cut -= 1
+            yield text[:cut]
+            text = self.indent + text[cut:]
+        yield text
+
+    def render_page(self, writer, lines):
+        content = b'BT /F1 %d Tf %d TL %d %d Td\n' % (
+            self.font_size, self.leading, self.margin,
+            self.page_height - self.margin)
+        content += b''.join(b'%s Tj T*\n' % writer.encode(line)
+                            for line in lines)
+        return content + b'ET'
+
+    def stream(self):
+        writer = PdfWriter(self.page_width, self.page_height)
+        yield writer.header()
+        lines_per_page = self.get_lines_per_page()
+        page = []
+        for line in self.get_lines():
+            for part in self.wrap(writer.font, line):
+                page.append(part)
+                if len(page) == lines_per_page:
+                    yield writer.page(self.render_page(writer, page))
+                    page = []
+        if page or not writer.pages:
+            yield writer.page(self.render_page(writer, page))
+        yield writer.trailer()
+
+
+EXPORTERS = {
+    exporter.extension: exporter
+    for exporter in (TxtExporter, CsvExporter, PdfExporter)
+}
@@ -0,0 +1,107 @@
+import base64
+import io
+import re
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """Список связанных объектов, загружаемых одним запросом id__in."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        return self.child_relation.to_internal_values(data)
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField, который с many=True проверяет все ключи
+    одним запросом и сообщает обо всех отсутствующих объектах сразу.
+    """
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def to_pk(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return self.get_queryset().model._meta.pk.to_python(data)
+        except DjangoValidationError:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+    def to_internal_values(self, data):
+        pks = [self.to_pk(value) for value in data]
+        objects = self.get_queryset().in_bulk(set(pks))
+        missing = [pk for pk in dict.fromkeys(pks) if pk not in objects]
+        if missing:
+            raise serializers.ValidationError([
+                self.error_messages['does_not_exist'].format(pk_value=pk)
+                for pk in missing
+            ])
+        return [objects[pk] for pk in pks]
+
+
+class Base64Image:
+    """Картинка из запроса: имя файла и ещё не декодированный base64."""
+
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+
+
+class DeferredBase64ImageField(Base64ImageField):
+    """
+    Картинка в base64, которая на запросе только открывается по первым
+    IMAGE_CHECK_SIZE байтам. Декодирование, запись в хранилище и
+    варианты размеров выполняет фоновый обработчик api.images.
+    """
+    BASE64_RE = re.compile(r'[A-Za-z0-9+/]*={0,2}')
+    # Разрешённые форматы и их расширения
+    FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif'}
+
+    @staticmethod
+    def open_image(base64_data):
+        """
+        Формат картинки по началу файла. Если файл уместился в
+        IMAGE_CHECK_SIZE целиком, проверяется и его структура.
+        """
+        size = settings.IMAGE_CHECK_SIZE // 3 * 4
+        content = base64.b64decode(base64_data[:size])
+        with Image.open(io.BytesIO(content)) as picture:
+            if len(base64_data) <= size:
+                picture.verify()
+            return picture.format
+
+    def to_internal_value(self, base64_data):
+        if base64_data in self.EMPTY_VALUES:
+            return None
+        if not isinstance(base64_data, str):
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        if ';base64,' in base64_data:
+            _, base64_data = base64_data.split(';base64,', 1)
+        if (not base64_data or len(base64_data) % 4
+                or not self.BASE64_RE.fullmatch(base64_data)):
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        try:
+            image_format = self.open_image(base64_data)
+        except Exception:
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        if image_format not in self.FORMATS:
+            raise serializers.ValidationError(self.INVALID_TYPE_MESSAGE)
+        return Base64Image(f'{uuid4().hex}.{self.FORMATS[image_format]}',
+                           base64_data)
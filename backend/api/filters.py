@@ -1,15 +1,27 @@
 from django.contrib.auth import get_user_model
-from django_filters.rest_framework import (BooleanFilter, CharFilter,
-                                           FilterSet,
-                                           ModelMultipleChoiceFilter)
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+from django_filters.rest_framework import (BaseInFilter, BooleanFilter,
+                                           CharFilter, FilterSet,
+                                           ModelMultipleChoiceFilter,
+                                           NumberFilter)
 
-from recipe.models import Ingredient, Recipe, Tag
+from recipe.models import Ingredient, IngredientAmount, Recipe, Tag
+
+from . import search
 
 User = get_user_model()
 
 
+class NumberInFilter(BaseInFilter, NumberFilter):
+    pass
+
+
 class RecipeFilter(FilterSet):
-    """Фильтрация по автору, тэгу, избранному и добавленному в покупки."""
+    """
+    Фильтрация по автору, тэгу, избранному и добавленному в покупки,
+    полнотекстовый поиск по названию и описанию, подбор рецептов
+    по имеющимся ингредиентам.
+    """
     tags = ModelMultipleChoiceFilter(
         field_name='tags__slug',
         to_field_name='slug',
@@ -18,6 +30,9 @@ class RecipeFilter(FilterSet):
     author = CharFilter(method='filter_author')
     is_favorited = BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = BooleanFilter(method='filter_is_in_shopping_cart')
+    search = CharFilter(method='filter_search')
+    have = NumberInFilter(method='filter_have')
+    missing = NumberFilter(method='filter_missing', min_value=0)
 
     class Meta:
         model = Recipe
@@ -43,6 +58,34 @@ class RecipeFilter(FilterSet):
         return self._filter_is_param(queryset, name,
                                      value, param='shopping_cart')
 
+    def filter_search(self, queryset, name, value):
+        if not value.strip():
+            return queryset
+        return search.search_recipes(queryset, value)
+
+    def filter_have(self, queryset, name, value):
+        """
+        Рецепты, в которых есть хотя бы один из ингредиентов.
+        Сначала те, где недостающих меньше, затем где совпадений больше.
+        """
+        ids = {int(pk) for pk in value}
+        if not ids:
+            return queryset
+        # Агрегаты считаются только по рецептам с этими ингредиентами:
+        # выборка идёт по индексу ингредиента, а не по всем рецептам.
+        queryset = queryset.filter(id__in=IngredientAmount.objects.filter(
+            ingredient__in=ids).values('recipe'))
+        return queryset.annotate(
+            matched=Count('ingredient_list', distinct=True,
+                          filter=Q(ingredient_list__ingredient__in=ids)),
+            missing=Count('ingredient_list', distinct=True) - F('matched'),
+        ).order_by('missing', '-matched', '-id')
+
+    def filter_missing(self, queryset, name, value):
+        if 'missing' not in queryset.query.annotations:
+            return queryset
+        return queryset.filter(missing__lte=value)
+
     def get_is_favorited(self, queryset, name, value):
         if not value:
             return queryset
@@ -55,11 +98,16 @@ class RecipeFilter(FilterSet):
 
 
 class IngredientFilter(FilterSet):
-    """Фильтрация ингредиентов"""
-    name = CharFilter(label='name',
-                      field_name='name',
-                      lookup_expr='icontains')
+    """Фильтрация ингредиентов: сначала по началу названия, затем вхождение"""
+    name = CharFilter(label='name', method='filter_name')
 
     class Meta:
         model = Ingredient
         fields = ('name',)
+
+    def filter_name(self, queryset, name, value):
+        return queryset.filter(name__icontains=value).annotate(
+            is_prefix=Case(When(name__istartswith=value, then=Value(0)),
+                           default=Value(1),
+                           output_field=IntegerField())
+        ).order_by('is_prefix', 'name')
@@ -0,0 +1,109 @@
+import base64
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image, ImageOps, features
+
+from recipe.models import Recipe
+
+from . import documents
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=settings.IMAGE_WORKERS,
+                              thread_name_prefix='recipe-images')
+
+VARIANT_FORMAT = 'WEBP' if features.check('webp') else 'JPEG'
+VARIANT_EXTENSION = 'webp' if VARIANT_FORMAT == 'WEBP' else 'jpg'
+
+
+def schedule(recipe, image):
+    """Ставит обработку картинки рецепта в очередь после коммита."""
+    transaction.on_commit(partial(executor.submit, process,
+                                  recipe.pk, image.name, image.data))
+
+
+def delete_files(*paths):
+    for path in paths:
+        if path:
+            default_storage.delete(path)
+
+
+def render_variant(picture, width):
+    variant = picture.copy()
+    variant.thumbnail((width, width * 10))
+    if variant.mode not in ('RGB', 'RGBA'):
+        variant = variant.convert('RGBA' if 'A' in variant.getbands()
+                                  else 'RGB')
+    if VARIANT_FORMAT == 'JPEG' and variant.mode == 'RGBA':
+        variant = variant.convert('RGB')
+    buffer = io.BytesIO()
+    variant.save(buffer, VARIANT_FORMAT, quality=settings.IMAGE_QUALITY)
+    return buffer.getvalue()
+
+
+def save_variants(image_path, content):
+    """Уменьшенные копии картинки: {ширина: путь}."""
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    variants = {}
+    try:
+        with Image.open(io.BytesIO(content)) as picture:
+            picture = ImageOps.exif_transpose(picture)
+            # Варианты шире оригинала не нужны: thumbnail не увеличивает
+            for width in settings.IMAGE_VARIANT_WIDTHS:
+                if width > picture.width:
+                    continue
+                variants[str(width)] = default_storage.save(
+                    f'recipe_images/variants/{stem}_{width}.'
+                    f'{VARIANT_EXTENSION}',
+                    ContentFile(render_variant(picture, width)))
+    except Exception:
+        delete_files(*variants.values())
+        raise
+    return variants
+
+
+def process(recipe_id, name, data):
+    """
+    Сохраняет оригинал и уменьшенные варианты, обновляет рецепт и удаляет
+    файлы прежней картинки. Если варианты построить не удалось, рецепт
+    получает один оригинал.
+    """
+    saved = []
+    try:
+        content = base64.b64decode(data)
+        image_path = default_storage.save(
+            os.path.join(Recipe.image.field.upload_to, name),
+            ContentFile(content))
+        saved.append(image_path)
+        try:
+            variants = save_variants(image_path, content)
+        except Exception:
+            logger.exception('Не удалось построить варианты картинки '
+                             'рецепта %s', recipe_id)
+            variants = {}
+        saved.extend(variants.values())
+        with transaction.atomic():
+            previous = Recipe.objects.select_for_update().filter(
+                pk=recipe_id).values_list('image', 'image_variants').first()
+            if previous is not None:
+                Recipe.objects.filter(pk=recipe_id).update(
+                    image=image_path, image_variants=variants)
+                documents.invalidate(recipe_id)
+        if previous is not None:
+            # Новые файлы принадлежат рецепту, не нужны прежние
+            old_image, old_variants = previous
+            saved = [old_image, *old_variants.values()]
+    except Exception:
+        logger.exception('Не удалось обработать картинку рецепта %s',
+                         recipe_id)
+    finally:
+        delete_files(*saved)
+        connection.close()
@@ -0,0 +1,79 @@
+import json
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+
+from recipe.models import Recipe
+from users.models import Subscriptions, User
+
+from ...benchmark import (READ_SCENARIOS, SCENARIOS, BenchmarkClient, run,
+                          throughput)
+
+
+class Command(BaseCommand):
+    """Нагрузочные замеры сценариев API"""
+    help = ('Прогоняет сценарии через тестовый клиент и печатает '
+            'p50/p95/p99 задержки, запросы к БД и пик памяти в JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*',
+                            help=f'По умолчанию все: {", ".join(SCENARIOS)}')
+        parser.add_argument('--requests', default=50, type=int)
+        parser.add_argument('--warmup', default=5, type=int)
+        parser.add_argument('--user', help='username, по умолчанию '
+                                           'пользователь с наибольшим '
+                                           'числом подписок')
+        parser.add_argument('--seed', default=1, type=int)
+        parser.add_argument('--concurrency', default=0, type=int,
+                            help='Число параллельных клиентов для '
+                                 'сравнения WSGI и ASGI на сценариях чтения')
+        parser.add_argument('--output', help='Записать результат в файл')
+
+    def get_user(self, username):
+        if username:
+            user = User.objects.filter(username=username).first()
+        else:
+            user = User.objects.annotate(
+                follows=Count('subscriber')
+            ).order_by('-follows', 'id').first()
+        if user is None:
+            raise CommandError('Нет пользователя: выполните fake_data.')
+        return user
+
+    def handle(self, *args, **options):
+        unknown = set(options['scenarios']) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Нет сценариев: {", ".join(sorted(unknown))}')
+        rnd = random.Random(options['seed'])
+        client = BenchmarkClient(self.get_user(options['user']))
+        report = {
+            'database': connection.vendor,
+            'user': client.user.username,
+            'scale': {
+                'users': User.objects.count(),
+                'recipes': Recipe.objects.count(),
+                'subscriptions': Subscriptions.objects.count(),
+            },
+            'scenarios': {},
+        }
+        for name in options['scenarios'] or SCENARIOS:
+            report['scenarios'][name] = run(
+                client, name, options['requests'], options['warmup'], rnd)
+            self.stderr.write(f'... {name}')
+        if options['concurrency'] > 0:
+            report['throughput'] = {'concurrency': options['concurrency']}
+            for name in options['scenarios'] or READ_SCENARIOS:
+                if name not in READ_SCENARIOS:
+                    continue
+                report['throughput'][name] = throughput(
+                    client.user, name, options['concurrency'],
+                    options['requests'], options['seed'])
+                self.stderr.write(f'... {name}: wsgi/asgi')
+        data = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(data)
+        else:
+            self.stdout.write(data)
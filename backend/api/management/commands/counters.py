@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...counters import COUNTERS, reconcile, stale_rows
+
+
+class Command(BaseCommand):
+    """Сверка счётчиков избранного, подписчиков и рецептов"""
+    help = 'Пересчитывает денормализованные счётчики по фактическим данным'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Только проверить счётчики')
+
+    def handle(self, *args, **options):
+        stale = 0
+        for counter in COUNTERS:
+            model, field = counter[:2]
+            if options['verify']:
+                count = stale_rows(*counter).count()
+            else:
+                count = reconcile(*counter)
+            stale += count
+            self.stdout.write(
+                f'{model._meta.object_name}.{field}: '
+                f'{"расходится" if options["verify"] else "исправлено"} '
+                f'{count}')
+        if options['verify'] and stale:
+            raise CommandError('Счётчики расходятся с данными.')
+        self.stdout.write(self.style.SUCCESS('Счётчики актуальны.'))
@@ -0,0 +1,186 @@
+import random
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from recipe.models import (Carts, Favorites, FeedEntry, Ingredient,
+                           IngredientAmount, Recipe, ShoppingListItem, Tag)
+from users.models import Subscriptions, User
+
+from ... import search
+from ...counters import COUNTERS, reconcile
+
+PREFIX = 'bench_'
+WORDS = ('суп', 'салат', 'пирог', 'каша', 'рагу', 'борщ', 'плов', 'омлет',
+         'запеканка', 'котлеты', 'курица', 'говядина', 'грибы', 'сыр',
+         'томатный', 'сливочный', 'острый', 'домашний', 'быстрый', 'летний')
+
+
+class Command(BaseCommand):
+    """Синтетические данные для нагрузочных замеров"""
+    help = ('Создаёт пользователей bench_*, их рецепты, подписки '
+            '(степенное распределение), избранное и корзины')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', default=200, type=int)
+        parser.add_argument('--recipes-per-user', default=5, type=int)
+        parser.add_argument('--ingredients-per-recipe', default=8, type=int)
+        parser.add_argument('--follows-per-user', default=10, type=int,
+                            help='Среднее число подписок пользователя')
+        parser.add_argument('--alpha', default=1.2, type=float,
+                            help='Показатель степенного распределения '
+                                 'популярности авторов')
+        parser.add_argument('--favorites-per-user', default=20, type=int)
+        parser.add_argument('--carts-per-user', default=3, type=int)
+        parser.add_argument('--tags', default=6, type=int)
+        parser.add_argument('--ingredients', default=500, type=int,
+                            help='Минимальный размер справочника')
+        parser.add_argument('--seed', default=1, type=int)
+        parser.add_argument('--batch-size', default=5000, type=int)
+        parser.add_argument('--clear', action='store_true',
+                            help='Удалить данные предыдущего запуска')
+
+    def log(self, message):
+        self.stdout.write(message)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        if options['clear']:
+            deleted, _ = User.objects.filter(
+                username__startswith=PREFIX).delete()
+            self.log(f'Удалено объектов: {deleted}')
+        with transaction.atomic():
+            tags = self.tags(options['tags'])
+            ingredients = self.ingredients(options['ingredients'])
+            users = self.users(options['users'])
+            recipes = self.recipes(users, tags, ingredients, options)
+            follows = self.subscriptions(users, options)
+            self.relations(users, recipes, Favorites,
+                           options['favorites_per_user'])
+            self.relations(users, recipes, Carts, options['carts_per_user'])
+            self.derived(users, recipes, follows)
+        # PostgreSQL не создаёт индекс по таблице с отложенными проверками
+        # внешних ключей, поэтому индекс строится после коммита.
+        search.create_index(connection.alias)
+        self.log('... поиск')
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: {len(users)} пользователей, {len(recipes)} рецептов, '
+            f'{len(follows)} подписок.'))
+
+    def tags(self, count):
+        Tag.objects.bulk_create([
+            Tag(name=f'{PREFIX}тег {i}', color=f'#{i * 40 % 256:02X}8080',
+                slug=f'{PREFIX}{i}')
+            for i in range(count)
+        ], ignore_conflicts=True)
+        return list(Tag.objects.values_list('id', flat=True))
+
+    def ingredients(self, count):
+        missing = count - Ingredient.objects.count()
+        if missing > 0:
+            Ingredient.objects.bulk_create([
+                Ingredient(name=f'{PREFIX}ингредиент {i}',
+                           measurement_unit='г')
+                for i in range(missing)
+            ], batch_size=self.batch_size, ignore_conflicts=True)
+        return list(Ingredient.objects.values_list('id', flat=True))
+
+    def users(self, count):
+        start = User.objects.filter(username__startswith=PREFIX).count()
+        password = make_password(None)
+        User.objects.bulk_create([
+            User(username=f'{PREFIX}{i}', email=f'{PREFIX}{i}@example.com',
+                 first_name='Имя', last_name='Фамилия', password=password)
+            for i in range(start, start + count)
+        ], batch_size=self.batch_size)
+        users = list(User.objects.filter(
+            username__startswith=PREFIX).values_list('id', flat=True))
+        self.log(f'... пользователи {len(users)}')
+        return users
+
+    def recipes(self, users, tags, ingredients, options):
+        choice, sample = self.random.choice, self.random.sample
+        Recipe.objects.bulk_create([
+            Recipe(author_id=author_id,
+                   name=f'{" ".join(sample(WORDS, 3))} {author_id}-{i}',
+                   text=' '.join(choice(WORDS) for _ in range(30)),
+                   cooking_time=self.random.randint(5, 180),
+                   image='recipe_images/bench.jpg')
+            for author_id in users
+            for i in range(options['recipes_per_user'])
+        ], batch_size=self.batch_size, ignore_conflicts=True)
+        recipes = dict(Recipe.objects.filter(author_id__in=users).values_list(
+            'id', 'author_id'))
+        self.log(f'... рецепты {len(recipes)}')
+        per_recipe = min(options['ingredients_per_recipe'], len(ingredients))
+        IngredientAmount.objects.bulk_create(
+            (IngredientAmount(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                              amount=self.random.randint(1, 500))
+             for recipe_id in recipes
+             for ingredient_id in sample(ingredients, per_recipe)),
+            batch_size=self.batch_size, ignore_conflicts=True)
+        Recipe.tags.through.objects.bulk_create(
+            (Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+             for recipe_id in recipes
+             for tag_id in sample(tags, min(2, len(tags)))),
+            batch_size=self.batch_size, ignore_conflicts=True)
+        return recipes
+
+    def subscriptions(self, users, options):
+        """
+        Популярность автора ~ 1 / rank^alpha: немногие авторы собирают
+        большую часть подписчиков.
+        """
+        weights = [1 / rank ** options['alpha']
+                   for rank in range(1, len(users) + 1)]
+        follows = set()
+        for subscriber_id in users:
+            count = min(int(self.random.expovariate(
+                1 / max(options['follows_per_user'], 1))), len(users) - 1)
+            for author_id in self.random.choices(users, weights, k=count):
+                if author_id != subscriber_id:
+                    follows.add((subscriber_id, author_id))
+        Subscriptions.objects.bulk_create(
+            (Subscriptions(subscriber_id=subscriber_id, author_id=author_id)
+             for subscriber_id, author_id in follows),
+            batch_size=self.batch_size, ignore_conflicts=True)
+        self.log(f'... подписки {len(follows)}')
+        return follows
+
+    def relations(self, users, recipes, model, per_user):
+        recipe_ids = list(recipes)
+        model.objects.bulk_create(
+            (model(user_id=user_id, recipe_id=recipe_id)
+             for user_id in users
+             for recipe_id in self.random.sample(
+                recipe_ids, min(per_user, len(recipe_ids)))),
+            batch_size=self.batch_size, ignore_conflicts=True)
+        self.log(f'... {model._meta.verbose_name_plural.lower()}')
+
+    def derived(self, users, recipes, follows):
+        """Счётчики, сводные списки покупок и ленты."""
+        for counter in COUNTERS:
+            reconcile(*counter)
+        ShoppingListItem.objects.rebuild(users, batch_size=self.batch_size)
+        latest = {}
+        for recipe_id, author_id, pub_date in Recipe.objects.filter(
+                id__in=list(recipes)).order_by('-pub_date', '-id').values_list(
+                'id', 'author_id', 'pub_date').iterator():
+            latest.setdefault(author_id, []).append((recipe_id, pub_date))
+        pulled = set(User.objects.filter(
+            id__in=users,
+            followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS,
+        ).values_list('id', flat=True))
+        backfill = settings.FEED_BACKFILL_SIZE
+        FeedEntry.objects.bulk_create(
+            (FeedEntry(user_id=subscriber_id, recipe_id=recipe_id,
+                       pub_date=pub_date)
+             for subscriber_id, author_id in follows
+             if author_id not in pulled
+             for recipe_id, pub_date in latest.get(author_id, ())[:backfill]),
+            batch_size=self.batch_size, ignore_conflicts=True)
+        FeedEntry.objects.trim(users)
+        self.log('... счётчики, списки покупок, ленты')
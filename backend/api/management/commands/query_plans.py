@@ -0,0 +1,113 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+
+from recipe.models import (Carts, Favorites, FeedEntry, IngredientAmount,
+                           Recipe, ShoppingListItem)
+from users.models import Subscriptions, User
+
+INDEXED_MODELS = (Recipe, IngredientAmount, Favorites, Carts, Subscriptions,
+                  FeedEntry)
+
+# Одиночные индексы внешних ключей, которые перекрыты составными.
+REPLACED_INDEXES = (
+    (Recipe, 'author'),
+    (IngredientAmount, 'recipe'),
+    (IngredientAmount, 'ingredient'),
+    (Favorites, 'user'),
+    (Favorites, 'recipe'),
+    (Carts, 'user'),
+    (Carts, 'recipe'),
+    (Subscriptions, 'author'),
+    (Subscriptions, 'subscriber'),
+    (ShoppingListItem, 'user'),
+    (FeedEntry, 'user'),
+)
+
+
+class Command(BaseCommand):
+    """Планы запросов основных выборок до и после составных индексов"""
+    help = ('Показывает EXPLAIN основных выборок с текущими индексами, '
+            'а с --swap-indexes и с прежним набором индексов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--analyze', action='store_true',
+                            help='EXPLAIN ANALYZE (только PostgreSQL)')
+        parser.add_argument(
+            '--swap-indexes', action='store_true',
+            help='Временно пересоздать индексы в прежнем виде. Таблицы '
+                 'блокируются до конца сравнения, не запускать на '
+                 'рабочей базе')
+
+    def get_querysets(self):
+        recipe = Recipe.objects.order_by('-favorites_count').first()
+        user = User.objects.order_by('-followers_count').first()
+        if recipe is None or user is None:
+            raise CommandError('Нет данных: сначала заполните базу.')
+        tag = recipe.tags.first()
+        ingredient_ids = list(recipe.ingredient_list.values_list(
+            'ingredient_id', flat=True)[:3])
+        return {
+            'Список рецептов': Recipe.objects.all()[:10],
+            'Рецепты по тегу': Recipe.objects.filter(
+                tags__slug=getattr(tag, 'slug', ''))[:10],
+            'Рецепты автора': Recipe.objects.filter(author=user)[:10],
+            'Ингредиенты рецепта': IngredientAmount.objects.filter(
+                recipe=recipe).select_related('ingredient'),
+            'Подбор по ингредиентам': IngredientAmount.objects.filter(
+                ingredient__in=ingredient_ids).values('recipe').annotate(
+                matched=models.Count('id')),
+            'Избранное пользователя': Favorites.objects.filter(user=user),
+            'Рецепт в избранном': Favorites.objects.filter(recipe=recipe),
+            'Корзина пользователя': Carts.objects.filter(user=user),
+            'Рецепт в корзинах': Carts.objects.filter(recipe=recipe),
+            'Подписки пользователя': Subscriptions.objects.filter(
+                subscriber=user),
+            'Подписчики автора': Subscriptions.objects.filter(author=user),
+            'Лента подписок': FeedEntry.objects.filter(user=user).order_by(
+                '-pub_date', '-recipe_id')[:10],
+        }
+
+    def explain(self, title, analyze):
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        options = {'analyze': True} if analyze else {}
+        for name, queryset in self.get_querysets().items():
+            self.stdout.write(self.style.MIGRATE_LABEL(name))
+            self.stdout.write(queryset.explain(**options))
+            self.stdout.write('')
+
+    @staticmethod
+    def swap_indexes(previous):
+        current = [(model, index) for model in INDEXED_MODELS
+                   for index in model._meta.indexes]
+        replaced = [
+            (model, models.Index(
+                fields=[field],
+                name=f'{model._meta.db_table}_{field}_idx'[:30]))
+            for model, field in REPLACED_INDEXES
+        ]
+        drop, create = current, replaced
+        if not previous:
+            drop, create = create, drop
+        with connection.schema_editor() as schema_editor:
+            for model, index in drop:
+                schema_editor.remove_index(model, index)
+            for model, index in create:
+                schema_editor.add_index(model, index)
+
+    def handle(self, *args, **options):
+        analyze = options['analyze'] and connection.vendor == 'postgresql'
+        self.explain('Текущие индексы', analyze)
+        if not options['swap_indexes']:
+            return
+        if connection.vendor == 'postgresql':
+            # Прежние индексы живут только внутри откатываемой транзакции
+            with transaction.atomic():
+                self.swap_indexes(previous=True)
+                self.explain('Прежние индексы', analyze)
+                transaction.set_rollback(True)
+            return
+        self.swap_indexes(previous=True)
+        try:
+            self.explain('Прежние индексы', analyze)
+        finally:
+            self.swap_indexes(previous=False)
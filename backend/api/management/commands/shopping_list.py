@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipe.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    """Пересчёт сводных списков покупок"""
+    help = 'Пересобирает или проверяет сводные списки покупок пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Только сверить списки с корзинами')
+        parser.add_argument('--batch-size', default=1000, type=int)
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            return self.verify()
+        with transaction.atomic():
+            ShoppingListItem.objects.rebuild(
+                batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Списки покупок пересобраны: '
+            f'{ShoppingListItem.objects.count()} строк.'))
+        return None
+
+    def verify(self):
+        expected = {
+            (row['recipe__shopping_cart__user'], row['ingredient']):
+                row['total']
+            for row in ShoppingListItem.objects.aggregate().iterator()
+        }
+        actual = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total
+            in ShoppingListItem.objects.values_list(
+                'user_id', 'ingredient_id', 'total_amount').iterator()
+        }
+        users = {
+            user_id for user_id, _ in expected.keys() ^ actual.keys()
+        } | {
+            user_id for (user_id, ingredient_id), total in expected.items()
+            if actual.get((user_id, ingredient_id), total) != total
+        }
+        if users:
+            raise CommandError(
+                f'Списки покупок расходятся с корзинами у пользователей: '
+                f'{", ".join(map(str, sorted(users)))}')
+        self.stdout.write(self.style.SUCCESS('Списки покупок актуальны.'))
+        return None
@@ -1,35 +1,11 @@
-import csv
-import os
-
-from django.conf import settings
-from django.core.management.base import BaseCommand, CommandError
-
 from recipe.models import Tag
 
+from ..loaders import BulkLoadCommand
 
-class Command(BaseCommand):
-    """Заполнение базы данных тегами"""
-    help = 'Добавляет данные ингредиентов из файла json или csv'
 
-    def add_arguments(self, parser):
-        parser.add_argument('filename', default='tags.csv', nargs='?',
-                            type=str)
-
-    def handle(self, *args, **options):
-        try:
-            with open(os.path.join(
-                    settings.BASE_DIR,
-                    './data',
-                    options['filename']),
-                    'r',
-                    encoding='utf-8') as f:
-                data = csv.reader(f)
-                for row in data:
-                    name, slug, color = row
-                    Tag.objects.get_or_create(
-                        color=color,
-                        name=name,
-                        slug=slug
-                        )
-        except FileNotFoundError:
-            raise CommandError('Файл tags.csv отсутствует в папке data')
+class Command(BulkLoadCommand):
+    """Заполнение базы данных тегами"""
+    help = 'Добавляет данные тегов из файла json или csv'
+    model = Tag
+    fields = ('name', 'slug', 'color')
+    default_filename = 'tags.csv'
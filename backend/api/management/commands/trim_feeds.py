@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipe.models import FeedEntry
+from users.models import User
+
+
+class Command(BaseCommand):
+    """Обрезка лент подписок"""
+    help = (f'Оставляет в каждой ленте подписок не больше '
+            f'FEED_MAX_ENTRIES ({settings.FEED_MAX_ENTRIES}) последних '
+            f'записей; запускается по расписанию')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', default=1000, type=int,
+                            help='Число пользователей в одном DELETE')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        user_ids = list(User.objects.order_by('id').values_list(
+            'id', flat=True))
+        deleted = sum(
+            FeedEntry.objects.trim(user_ids[start:start + batch_size])
+            for start in range(0, len(user_ids), batch_size))
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено записей лент: {deleted}.'))
@@ -0,0 +1,126 @@
+import csv
+import json
+import os
+import re
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ..cache import bump_version
+
+
+class BulkLoadCommand(BaseCommand):
+    """
+    Базовая команда загрузки справочника из csv или json.
+    Файл читается потоково, строки вставляются пачками через bulk_create,
+    уже существующие записи пропускаются по ограничениям уникальности.
+    """
+    model = None
+    fields = ()
+    default_filename = None
+    read_size = 64 * 1024
+    separators = re.compile(r'[\s,]*')
+
+    def add_arguments(self, parser):
+        parser.add_argument('filename', default=self.default_filename,
+                            nargs='?', type=str)
+        parser.add_argument('--batch-size', default=5000, type=int,
+                            help='Количество строк в одной вставке')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только прочитать и проверить файл')
+
+    def get_path(self, filename):
+        return os.path.join(settings.BASE_DIR, 'data', filename)
+
+    def read_csv(self, file):
+        for line, row in enumerate(csv.reader(file), start=1):
+            if not row:
+                continue
+            if len(row) != len(self.fields):
+                raise CommandError(
+                    f'Строка {line}: ожидается {len(self.fields)} поля, '
+                    f'получено {len(row)}.')
+            yield dict(zip(self.fields, row))
+
+    def read_json(self, file):
+        decoder = json.JSONDecoder()
+        buffer = file.read(self.read_size).lstrip()
+        if not buffer.startswith('['):
+            raise CommandError('Ожидается JSON-массив объектов.')
+        position = 1
+        while True:
+            position = self.separators.match(buffer, position).end()
+            if buffer.startswith(']', position):
+                return
+            try:
+                obj, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                chunk = file.read(self.read_size)
+                if not chunk:
+                    raise CommandError('Некорректный JSON.')
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            if not isinstance(obj, dict):
+                raise CommandError('Ожидается JSON-массив объектов.')
+            yield {field: obj.get(field) for field in self.fields}
+
+    def read(self, file, filename):
+        if filename.endswith('.json'):
+            return self.read_json(file)
+        return self.read_csv(file)
+
+    def get_object(self, row):
+        return self.model(**{
+            field: value.strip() if isinstance(value, str) else value
+            for field, value in row.items()
+        })
+
+    def save(self, objects, batch_size):
+        self.model.objects.bulk_create(objects, batch_size=batch_size,
+                                       ignore_conflicts=True)
+
+    def handle(self, *args, **options):
+        filename = options['filename']
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        self.verbosity = options['verbosity']
+        if batch_size < 1:
+            raise CommandError('--batch-size должен быть больше нуля.')
+
+        count_before = 0 if dry_run else self.model.objects.count()
+        processed = 0
+        try:
+            with open(self.get_path(filename), 'r', encoding='utf-8') as f:
+                batch = []
+                for row in self.read(f, filename):
+                    batch.append(self.get_object(row))
+                    if len(batch) >= batch_size:
+                        processed = self.flush(batch, batch_size, dry_run,
+                                               processed)
+                        batch = []
+                processed = self.flush(batch, batch_size, dry_run,
+                                       processed)
+        except FileNotFoundError:
+            raise CommandError(f'Файл {filename} отсутствует в папке data')
+        finally:
+            if processed and not dry_run:
+                bump_version(self.model)
+
+        if dry_run:
+            self.stdout.write(self.style.SUCCESS(
+                f'Проверено строк: {processed}.'))
+            return
+        created = self.model.objects.count() - count_before
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано строк: {processed}, добавлено: {created}.'))
+
+    def flush(self, batch, batch_size, dry_run, processed):
+        if not batch:
+            return processed
+        if not dry_run:
+            self.save(batch, batch_size)
+        processed += len(batch)
+        if self.verbosity > 0:
+            self.stdout.write(f'... {processed}')
+        return processed
@@ -0,0 +1,168 @@
+"""
+Замеры запросов к API: число SQL-запросов, время SQL, время Python-кода
+представления (сериализация), время рендера и размер ответа по каждому
+действию. Отдаются в заголовке Server-Timing и копятся в скользящем окне
+внутри процесса.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('total', 'db', 'app', 'render', 'queries', 'size')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Действие выполнило больше SQL-запросов, чем разрешено."""
+
+
+class RequestMetrics:
+
+    def __init__(self):
+        self.endpoint = None
+        self.queries = 0
+        self.db = 0.0
+        self.view = 0.0
+        self.view_start = None
+        self.render = 0.0
+        self.render_start = None
+        self.total = 0.0
+        self.size = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - start
+            self.queries += 1
+
+    @property
+    def app(self):
+        return max(self.view - self.db, 0.0)
+
+    def server_timing(self):
+        return ', '.join((
+            f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries"',
+            f'app;dur={self.app * 1000:.1f}',
+            f'render;dur={self.render * 1000:.1f}',
+            f'total;dur={self.total * 1000:.1f}',
+        ))
+
+    def sample(self):
+        return (self.total * 1000, self.db * 1000, self.app * 1000,
+                self.render * 1000, self.queries, self.size)
+
+
+class Histogram:
+    """Последние METRICS_WINDOW замеров каждого действия."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(
+            lambda: deque(maxlen=settings.METRICS_WINDOW))
+
+    def add(self, endpoint, sample):
+        with self.lock:
+            self.samples[endpoint].append(sample)
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+
+    @staticmethod
+    def percentile(values, percent):
+        return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+    def summary(self):
+        with self.lock:
+            samples = {key: list(value) for key, value in self.samples.items()}
+        report = {}
+        for endpoint, rows in sorted(samples.items()):
+            report[endpoint] = {'count': len(rows)}
+            for field, values in zip(FIELDS, zip(*rows)):
+                values = sorted(values)
+                report[endpoint][field] = {
+                    name: round(self.percentile(values, percent), 2)
+                    for name, percent in (('p50', 50), ('p95', 95),
+                                          ('p99', 99), ('max', 100))
+                }
+        return report
+
+
+histogram = Histogram()
+
+
+def get_endpoint(view_func, method):
+    """RecipeViewSet.list, UserViewSet.subscriptions и т.п."""
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return f'{view_func.__module__}.{view_func.__name__}'
+    method = method.lower()
+    actions = getattr(view_func, 'actions', None) or {}
+    return f'{view_class.__name__}.{actions.get(method, method)}'
+
+
+def get_query_budget(endpoint):
+    return settings.QUERY_BUDGETS.get(endpoint, settings.QUERY_BUDGET)
+
+
+class MetricsMiddleware:
+    """
+    Должна стоять последней в MIDDLEWARE: тогда время между
+    process_template_response и возвратом ответа - это рендер.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = request.metrics = RequestMetrics()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(
+                    connections[alias].execute_wrapper(metrics))
+            response = self.get_response(request)
+        end = time.perf_counter()
+        metrics.total = end - start
+        if metrics.endpoint is None:
+            return response
+        if metrics.render_start is not None:
+            metrics.render = end - metrics.render_start
+        else:
+            metrics.view = end - metrics.view_start
+        if not response.streaming:
+            metrics.size = len(response.content)
+        response['Server-Timing'] = metrics.server_timing()
+        histogram.add(metrics.endpoint, metrics.sample())
+        self.check_query_budget(metrics)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics.endpoint = get_endpoint(view_func, request.method)
+        request.metrics.view_start = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        metrics = request.metrics
+        if metrics.endpoint is not None:
+            metrics.render_start = time.perf_counter()
+            metrics.view = metrics.render_start - metrics.view_start
+        return response
+
+    @staticmethod
+    def check_query_budget(metrics):
+        budget = get_query_budget(metrics.endpoint)
+        if budget is None or metrics.queries <= budget:
+            return
+        message = (f'{metrics.endpoint}: {metrics.queries} SQL-запросов '
+                   f'при бюджете {budget}')
+        if settings.QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
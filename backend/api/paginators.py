@@ -1,8 +1,96 @@
-from rest_framework.pagination import PageNumberPagination
+from django.core.paginator import Paginator
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (Cursor, CursorPagination,
+                                       PageNumberPagination)
+
+
+class CountPaginator(Paginator):
+    """Считает объекты без аннотаций, нужных только для текущей страницы."""
+    @cached_property
+    def count(self):
+        return self.object_list.values('pk').count()
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Пагинатор по курсору: без COUNT(*) и OFFSET.
+    Порядок берётся из атрибута представления cursor_ordering.
+    """
+    ordering = '-id'
+    page_size = 10
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'cursor_ordering', self.ordering)
+        if isinstance(ordering, str):
+            return (ordering,)
+        return tuple(ordering)
+
+
+class TimelinePagination(KeysetPagination):
+    """
+    Пагинатор ленты: позиция курсора - ключ (pub_date, id) последнего
+    рецепта страницы. Страницу выбирает timeline.page(position, limit).
+    Переход только вперёд.
+    """
+
+    def decode_position(self, request):
+        cursor = self.decode_cursor(request)
+        if cursor is None or cursor.position is None:
+            return None
+        pub_date, _, pk = cursor.position.rpartition('|')
+        pub_date = parse_datetime(pub_date)
+        if pub_date is None or not pk.isdigit():
+            raise NotFound(self.invalid_cursor_message)
+        return pub_date, int(pk)
+
+    def paginate_queryset(self, timeline, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        page = timeline.page(self.decode_position(request),
+                             self.page_size + 1)
+        self.has_next = len(page) > self.page_size
+        self.page = page[:self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        return self.encode_cursor(Cursor(
+            offset=0, reverse=False,
+            position=f'{last.pub_date.isoformat()}|{last.pk}'))
+
+    def get_previous_link(self):
+        return None
 
 
 class Pagination(PageNumberPagination):
-    """Пагинатор страницы"""
+    """
+    Пагинатор страницы.
+    С параметром cursor переключается на пагинацию по курсору.
+    """
+    django_paginator_class = CountPaginator
     page_size = 10
     page_size_query_param = 'limit'
     max_page_size = 100
+    cursor_query_param = 'cursor'
+    cursor_pagination_class = KeysetPagination
+
+    def __init__(self):
+        self.cursor_pagination = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param in request.query_params:
+            self.cursor_pagination = self.cursor_pagination_class()
+            return self.cursor_pagination.paginate_queryset(
+                queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_pagination is not None:
+            return self.cursor_pagination.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -3,6 +3,7 @@ from rest_framework.permissions import IsAuthenticatedOrReadOnly
 
 AllowAny = permissions.AllowAny
 IsAuthenticated = permissions.IsAuthenticated
+IsAdminUser = permissions.IsAdminUser
 
 
 class AuthorOrAdmin(IsAuthenticatedOrReadOnly):
@@ -0,0 +1,33 @@
+"""
+Связи текущего пользователя с объектами страницы: is_favorited,
+is_in_shopping_cart и is_subscribed. Флаги считаются подзапросами
+Exists() в выборке страницы, поэтому проверяются только её строки и
+всегда видят последнюю запись пользователя.
+"""
+from django.db.models import Exists, OuterRef
+
+from recipe.models import Carts, Favorites
+from users.models import Subscriptions
+
+
+def is_subscribed(user, author='pk'):
+    return Exists(Subscriptions.objects.filter(
+        subscriber=user, author=OuterRef(author)))
+
+
+def annotate_recipes(queryset, user):
+    if user.is_anonymous:
+        return queryset
+    return queryset.annotate(
+        is_favorited=Exists(Favorites.objects.filter(
+            user=user, recipe=OuterRef('pk'))),
+        is_in_shopping_cart=Exists(Carts.objects.filter(
+            user=user, recipe=OuterRef('pk'))),
+        is_subscribed=is_subscribed(user, 'author'),
+    )
+
+
+def annotate_users(queryset, user):
+    if user.is_anonymous:
+        return queryset
+    return queryset.annotate(is_subscribed=is_subscribed(user))
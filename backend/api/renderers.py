@@ -0,0 +1,27 @@
+from rest_framework.renderers import JSONRenderer
+
+
+class ShoppingListRenderer(JSONRenderer):
+    """
+    Формат выгрузки списка покупок для параметра format.
+    Сам файл отдаёт экспортёр, ошибки рендерит JSONRenderer
+    (RecipeViewSet.handle_exception).
+    """
+
+
+class TxtRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class CsvRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class PdfRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+
+
+SHOPPING_LIST_RENDERERS = (JSONRenderer, TxtRenderer, CsvRenderer, PdfRenderer)
@@ -0,0 +1,104 @@
+"""
+Чтение с реплик. Безопасные запросы к действиям из REPLICA_ENDPOINTS
+читают со случайной реплики из DATABASE_REPLICAS, всё остальное идёт
+в default. После успешной записи клиент на REPLICA_PIN_SECONDS
+закрепляется за default, чтобы видеть свои изменения; окно должно быть
+больше задержки репликации. Закрепление хранится в подписанной cookie,
+а при общем кэше ещё и в кэше: клиенты с токеном часто не хранят cookie.
+
+Локально: DB_REPLICAS=/tmp/replica.sqlite3, затем
+python manage.py migrate --database replica_1 или копия db.sqlite3.
+"""
+import hashlib
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+from .cache import is_shared
+from .metrics import get_endpoint
+
+# Токены и сессии читаются только с основной базы: сразу после входа
+# их может ещё не быть на реплике.
+PRIMARY_APPS = {'authtoken', 'sessions'}
+
+PIN_COOKIE = 'replica_pin'
+PIN_SALT = 'api.replicas.pin'
+
+read_alias = ContextVar('read_alias', default=None)
+
+
+def pin_key(request):
+    """Клиент определяется по токену или сессии, без запросов к БД."""
+    credential = (request.META.get('HTTP_AUTHORIZATION')
+                  or request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+    if not credential:
+        return None
+    digest = hashlib.sha256(credential.encode()).hexdigest()
+    return f'replica:pin:{digest}'
+
+
+def is_pinned(request):
+    if request.get_signed_cookie(PIN_COOKIE, default=None, salt=PIN_SALT,
+                                 max_age=settings.REPLICA_PIN_SECONDS):
+        return True
+    key = pin_key(request) if is_shared() else None
+    return key is not None and cache.get(key) is not None
+
+
+def pin(request, response):
+    response.set_signed_cookie(
+        PIN_COOKIE, '1', salt=PIN_SALT, max_age=settings.REPLICA_PIN_SECONDS,
+        httponly=True, samesite='Lax')
+    key = pin_key(request) if is_shared() else None
+    if key is not None:
+        cache.set(key, 1, timeout=settings.REPLICA_PIN_SECONDS)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        alias = read_alias.get()
+        if (alias is None or model._meta.app_label in PRIMARY_APPS
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaMiddleware:
+    """Ставится перед MetricsMiddleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = read_alias.set(None)
+        try:
+            response = self.get_response(request)
+        finally:
+            read_alias.reset(token)
+        if (settings.DATABASE_REPLICAS
+                and request.method not in SAFE_METHODS
+                and response.status_code < 400):
+            pin(request, response)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (settings.DATABASE_REPLICAS
+                and request.method in SAFE_METHODS
+                and get_endpoint(view_func, request.method)
+                in settings.REPLICA_ENDPOINTS
+                and not is_pinned(request)):
+            read_alias.set(random.choice(settings.DATABASE_REPLICAS))
@@ -0,0 +1,96 @@
+"""
+Полнотекстовый поиск рецептов по названию и описанию.
+
+PostgreSQL: хранимый столбец Recipe.search_vector (конфигурация russian)
+с GIN-индексом, сортировка по SearchRank.
+SQLite: виртуальная таблица FTS5 с той же выборкой, сортировка по bm25.
+"""
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connections
+from django.db.models import F
+
+from recipe.models import Recipe
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = f'{Recipe._meta.db_table}_search'
+
+
+def search_vector():
+    return (SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('text', weight='B', config=SEARCH_CONFIG))
+
+
+def fts_query(value):
+    """Каждое слово запроса - префикс, слова объединяются через AND."""
+    return ' '.join(f'"{word}"*' for word in value.replace('"', ' ').split())
+
+
+def create_index(using):
+    connection = connections[using]
+    table = connection.ops.quote_name(Recipe._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS recipe_recipe_search_vector '
+                f'ON {table} USING gin (search_vector)')
+            Recipe.objects.using(using).filter(
+                search_vector__isnull=True).update(
+                search_vector=search_vector())
+        elif connection.vendor == 'sqlite':
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+                f'USING fts5(name, text, tokenize=\'unicode61\')')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rank) '
+                f'VALUES (\'rank\', \'bm25(10.0, 1.0)\')')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, text) '
+                f'SELECT id, name, text FROM {table} '
+                f'WHERE id NOT IN (SELECT rowid FROM {FTS_TABLE})')
+
+
+def index_recipe(recipe, using):
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        Recipe.objects.using(using).filter(pk=recipe.pk).update(
+            search_vector=search_vector())
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT OR REPLACE INTO {FTS_TABLE} (rowid, name, text) '
+                f'VALUES (%s, %s, %s)', [recipe.pk, recipe.name, recipe.text])
+
+
+def unindex_recipe(recipe, using):
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                           [recipe.pk])
+
+
+def search_recipes(queryset, value):
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        query = SearchQuery(value, config=SEARCH_CONFIG,
+                            search_type='websearch')
+        return queryset.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        ).order_by('-rank', '-id')
+    if vendor == 'sqlite':
+        match = fts_query(value)
+        if not match:
+            return queryset
+        table = connections[queryset.db].ops.quote_name(
+            Recipe._meta.db_table)
+        # Соединение с FTS-таблицей, а не подзапрос на каждую строку:
+        # rank (bm25 с весами из create_index) считается за один проход.
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = {table}.id',
+                   f'{FTS_TABLE} MATCH %s'],
+            params=[match],
+            select={'rank': f'{FTS_TABLE}.rank'},
+        ).order_by('rank', '-id')
+    return queryset.filter(name__icontains=value)
@@ -1,13 +1,20 @@
+from collections import defaultdict
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
 from django.db import IntegrityError, transaction
-from drf_extra_fields.fields import Base64ImageField
+from django.db.models import Manager, Prefetch
+from django.http import Http404
 from rest_framework import serializers
 
-from recipe.models import (Carts, Favorites, Ingredient, IngredientAmount,
-                           Recipe, Tag)
+from recipe.models import (Carts, Favorites, FeedEntry, Ingredient,
+                           IngredientAmount, Recipe, ShoppingListItem, Tag)
 from users.models import Subscriptions
 
-from . import validators
+from . import documents, images, validators
+from .counters import update_counter, update_counters
+from .fields import BulkPrimaryKeyRelatedField, DeferredBase64ImageField
 
 User = get_user_model()
 
@@ -53,8 +60,9 @@ class UserSerializer(serializers.ModelSerializer):
                   'last_name',
                   'is_subscribed')
 
-    def get_is_subscribed(self, obj):
-        return obj.id in self.context.get('subscribed_users', [])
+    @staticmethod
+    def get_is_subscribed(obj):
+        return getattr(obj, 'is_subscribed', False)
 
 
 class UsersChangePasswordSerializer(serializers.ModelSerializer):
@@ -87,7 +95,7 @@ class UsersChangePasswordSerializer(serializers.ModelSerializer):
     def update(self, instance, validated_data):
         password = validated_data.get('new_password')
         instance.set_password(password)
-        instance.save()
+        instance.save(update_fields=('password',))
         return instance
 
 
@@ -110,14 +118,32 @@ class IngredientAmountGetSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'amount', 'measurement_unit')
 
 
+class IngredientAmountListSerializer(serializers.ListSerializer):
+    """Загружает ингредиенты всех строк одним запросом."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ingredient_field = BulkPrimaryKeyRelatedField(
+            queryset=Ingredient.objects.all())
+
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+        ingredients = self.ingredient_field.to_internal_values(
+            [item['id'] for item in items])
+        for item, ingredient in zip(items, ingredients):
+            item['id'] = ingredient
+        return items
+
+
 class IngredientAmountCreateSerializer(serializers.ModelSerializer):
     """Сериализатор времни приготовления"""
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
     amount = serializers.IntegerField()
 
     class Meta:
         model = IngredientAmount
         fields = ('id', 'amount')
+        list_serializer_class = IngredientAmountListSerializer
 
     @staticmethod
     def validate_amount(amount):
@@ -137,46 +163,149 @@ class TagGetSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'color', 'slug')
 
 
-class RecipeShortGetSerializer(serializers.ModelSerializer):
+class ImageVariantsMixin(serializers.Serializer):
+    """Ссылки на уменьшенные копии картинки рецепта."""
+    image_thumb = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
+
+    def get_image_url(self, path):
+        url = default_storage.url(path)
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+    def get_image_thumb(self, obj):
+        path = obj.image_variants.get(str(settings.IMAGE_THUMB_WIDTH))
+        if path is None:
+            path = obj.image.name
+        return self.get_image_url(path) if path else None
+
+    def get_image_srcset(self, obj):
+        if not obj.image_variants:
+            return None
+        return ', '.join(
+            f'{self.get_image_url(path)} {width}w'
+            for width, path in sorted(obj.image_variants.items(),
+                                      key=lambda item: int(item[0]))
+        )
+
+
+class RecipeShortGetSerializer(ImageVariantsMixin,
+                               serializers.ModelSerializer):
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_thumb', 'image_srcset',
+                  'cooking_time')
+
+
+class AuthorDocumentSerializer(serializers.ModelSerializer):
+    """Автор в документе рецепта, без is_subscribed."""
+
+    class Meta:
+        model = User
+        fields = ('id',) + documents.AUTHOR_FIELDS
 
 
-class RecipeGetSerializer(serializers.ModelSerializer):
-    """Сериализатор получения рецептов"""
+class RecipeDocumentSerializer(ImageVariantsMixin,
+                               serializers.ModelSerializer):
+    """Не зависящая от пользователя часть рецепта, ссылки без хоста."""
     tags = TagGetSerializer(many=True, read_only=True)
-    ingredients = serializers.SerializerMethodField(read_only=True)
+    ingredients = IngredientAmountGetSerializer(
+        many=True, read_only=True, source='ingredient_list')
+    author = AuthorDocumentSerializer(read_only=True)
+
+    class Meta:
+        model = Recipe
+        fields = (
+            'id', 'ingredients', 'tags', 'author', 'name', 'image',
+            'image_thumb', 'image_srcset', 'text', 'cooking_time'
+        )
+
+
+class RecipeGetListSerializer(serializers.ListSerializer):
+    """Документы всех рецептов страницы одним обращением к кэшу."""
+
+    def to_representation(self, data):
+        recipes = {recipe.pk: recipe for recipe in (
+            data.all() if isinstance(data, Manager) else data)}
+        return [
+            self.child.merge(recipes[document['id']], document)
+            for document in documents.get_many(
+                list(recipes), self.child.build_documents)
+        ]
+
+
+class RecipeGetSerializer(RecipeDocumentSerializer):
+    """Сериализатор получения рецептов: документ из кэша и флаги."""
     author = UserSerializer(read_only=True)
-    is_favorited = serializers.SerializerMethodField(read_only=True)
-    is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
+    is_favorited = serializers.BooleanField(read_only=True)
+    is_in_shopping_cart = serializers.BooleanField(read_only=True)
 
     class Meta:
         model = Recipe
         fields = (
             'id', 'ingredients', 'tags', 'is_favorited', 'is_in_shopping_cart',
-            'author', 'name', 'image', 'text', 'cooking_time'
+            'author', 'name', 'image', 'image_thumb', 'image_srcset', 'text',
+            'cooking_time'
         )
+        list_serializer_class = RecipeGetListSerializer
 
     @staticmethod
-    def get_ingredients(obj):
-        ingredients = IngredientAmount.objects.filter(recipe=obj)
-        return IngredientAmountGetSerializer(ingredients, many=True).data
+    def build_documents(pks):
+        recipes = Recipe.objects.filter(pk__in=pks).select_related(
+            'author'
+        ).prefetch_related(
+            Prefetch(
+                'ingredient_list',
+                queryset=IngredientAmount.objects.select_related('ingredient')
+            ),
+            'tags',
+        )
+        return RecipeDocumentSerializer(recipes, many=True).data
 
-    def get_is_favorited(self, obj):
-        return obj.id in self.context.get('favorite_recipes', [])
+    def absolute_url(self, url):
+        request = self.context.get('request')
+        if request is None or not url:
+            return url
+        return request.build_absolute_uri(url)
+
+    def merge(self, instance, document):
+        """Документ с флагами из аннотаций instance."""
+        author = document['author']
+        srcset = document['image_srcset']
+        if srcset:
+            srcset = ', '.join(
+                f'{self.absolute_url(url)} {width}'
+                for url, width in (item.rsplit(' ', 1)
+                                   for item in srcset.split(', ')))
+        values = {
+            **document,
+            'is_favorited': getattr(instance, 'is_favorited', False),
+            'is_in_shopping_cart': getattr(instance, 'is_in_shopping_cart',
+                                           False),
+            'author': {**author, 'is_subscribed': getattr(
+                instance, 'is_subscribed', False)},
+            'image': self.absolute_url(document['image']),
+            'image_thumb': self.absolute_url(document['image_thumb']),
+            'image_srcset': srcset,
+        }
+        return {field: values[field] for field in self.Meta.fields}
 
-    def get_is_in_shopping_cart(self, obj):
-        return obj.id in self.context.get('shopping_recipes', [])
+    def to_representation(self, instance):
+        for document in documents.get_many([instance.pk],
+                                           self.build_documents):
+            return self.merge(instance, document)
+        raise Http404
 
 
 class RecipeCreateSerializer(serializers.ModelSerializer):
     """Сериализатор создания рецептов"""
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = BulkPrimaryKeyRelatedField(
         queryset=Tag.objects.all(), many=True)
     ingredients = IngredientAmountCreateSerializer(many=True)
     cooking_time = serializers.IntegerField()
-    image = Base64ImageField()
+    image = DeferredBase64ImageField()
 
     class Meta:
         model = Recipe
@@ -193,13 +322,18 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         if not ingredients:
             raise serializers.ValidationError(
                 'Рецепт не может быть без ингредиентов.')
-        ingredients_set = list()
+        ingredients_set = set()
+        duplicates = dict()
         for ingredient in ingredients:
             ingredient_obj = ingredient.get('id')
             if ingredient_obj.id in ingredients_set:
-                raise serializers.ValidationError(
-                    f'Ингредиент "{ingredient_obj.name}" повторяется.')
-            ingredients_set.append(ingredient_obj.id)
+                duplicates[ingredient_obj.id] = ingredient_obj.name
+            ingredients_set.add(ingredient_obj.id)
+        if duplicates:
+            raise serializers.ValidationError([
+                f'Ингредиент "{name}" повторяется.'
+                for name in duplicates.values()
+            ])
         return ingredients
 
     @staticmethod
@@ -227,37 +361,72 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def _ingredients(instance, ingredients):
-        create_ingredients = list()
-        obj_id = (
-            IngredientAmount.objects.latest('id').id + 1
-            if IngredientAmount.objects.all().exists()
-            else 0
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(recipe=instance,
+                             ingredient=ingredient.get('id'),
+                             amount=ingredient.get('amount'))
+            for ingredient in ingredients
         )
-        for ingredient in ingredients:
-            kwargs = {
-                'id': obj_id,
-                'recipe': instance,
-                'ingredient': ingredient.get('id'),
-                'amount': ingredient.get('amount'),
-            }
-            create_ingredients.append(IngredientAmount(**kwargs))
-            obj_id += 1
 
-        IngredientAmount.objects.bulk_create(create_ingredients)
+    @staticmethod
+    def _sync_ingredients(instance, ingredients):
+        """
+        Приводит ингредиенты рецепта к присланным: добавляет новые,
+        меняет количество у изменившихся и удаляет отсутствующие.
+        Возвращает прежние и новые количества {id ингредиента: количество}.
+        """
+        current = {
+            row.ingredient_id: row
+            for row in IngredientAmount.objects.filter(recipe=instance)
+        }
+        old_amounts = {key: row.amount for key, row in current.items()}
+        new_amounts = {
+            ingredient.get('id').id: ingredient.get('amount')
+            for ingredient in ingredients
+        }
+        created, changed = [], []
+        for ingredient_id, amount in new_amounts.items():
+            row = current.get(ingredient_id)
+            if row is None:
+                created.append(IngredientAmount(recipe=instance,
+                                                ingredient_id=ingredient_id,
+                                                amount=amount))
+            elif row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+        removed = old_amounts.keys() - new_amounts.keys()
+
+        if removed:
+            IngredientAmount.objects.filter(
+                recipe=instance, ingredient_id__in=removed).delete()
+        if changed:
+            IngredientAmount.objects.bulk_update(changed, ('amount',))
+        if created:
+            IngredientAmount.objects.bulk_create(created)
+        return old_amounts, new_amounts
 
     @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
+        image = validated_data.pop('image')
         instance = super().create(validated_data)
+        if image:
+            images.schedule(instance, image)
         instance.tags.set(tags)
         self._ingredients(instance, ingredients)
+        update_counter(User, instance.author_id, 'recipes_count', 1)
+        FeedEntry.objects.fan_out(instance)
 
         instance.save()
         return instance
 
     @transaction.atomic
     def update(self, instance, validated_data):
+        image = validated_data.pop('image', None)
+        if image:
+            images.schedule(instance, image)
+
         tags = validated_data.get('tags')
         if tags:
             tags = validated_data.pop('tags')
@@ -266,8 +435,11 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         ingredients = validated_data.get('ingredients')
         if ingredients:
             ingredients = validated_data.pop('ingredients')
-            instance.ingredients.clear()
-            self._ingredients(instance, ingredients)
+            Recipe.objects.select_for_update().filter(pk=instance.pk).first()
+            old_amounts, new_amounts = self._sync_ingredients(instance,
+                                                              ingredients)
+            ShoppingListItem.objects.update_recipe(instance.id, old_amounts,
+                                                   new_amounts)
             instance.save()
 
         instance = super().update(instance, validated_data)
@@ -287,11 +459,25 @@ class ShoppingCartDownloadSerializer(serializers.ModelSerializer):
         fields = ('ingredients',)
 
 
+class SubscriberListSerializer(serializers.ListSerializer):
+    """Загружает рецепты всех авторов страницы одним запросом."""
+
+    def to_representation(self, data):
+        authors = list(data.all() if isinstance(data, Manager) else data)
+        recipes = defaultdict(list)
+        for recipe in Recipe.objects.latest_for_authors(
+                (author.id for author in authors),
+                self.child.get_recipes_limit()):
+            recipes[recipe.author_id].append(recipe)
+        for author in authors:
+            author.latest_recipes = recipes[author.id]
+        return super().to_representation(authors)
+
+
 class SubscriberGetSerializer(serializers.ModelSerializer):
     """Сериализатор получения подписок"""
     recipes = serializers.SerializerMethodField(read_only=True)
-    recipes_count = serializers.IntegerField(
-        source='recipes.count', read_only=True)
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
@@ -301,49 +487,160 @@ class SubscriberGetSerializer(serializers.ModelSerializer):
                   'last_name',
                   'recipes',
                   'recipes_count')
+        list_serializer_class = SubscriberListSerializer
 
-    def get_recipes(self, obj):
+    def get_recipes_limit(self):
         request = self.context.get('request')
-        recipes_limit = None
+        recipes_limit = ''
         if request:
-            recipes_limit = request.query_params.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if recipes_limit:
-            recipes = recipes[:int(recipes_limit)]
+            recipes_limit = request.query_params.get('recipes_limit', '')
+        return int(recipes_limit) if recipes_limit.isdigit() else None
+
+    def get_recipes(self, obj):
+        recipes = getattr(obj, 'latest_recipes', None)
+        if recipes is None:
+            recipes = obj.recipes.order_by('-id')
+            recipes_limit = self.get_recipes_limit()
+            if recipes_limit is not None:
+                recipes = recipes[:recipes_limit]
         return RecipeShortGetSerializer(recipes, many=True).data
 
 
 class FavoriteSerializer(serializers.ModelSerializer):
     """Сериализатор избранного"""
-    ERRORS_TEXT = {}
+    ERRORS_TEXT = {'not_found': 'Объект не найден.'}
+    # (модель со счётчиком, поле связи в данных, поле счётчика)
+    COUNTER = None
+    # Поле пользователя в данных
+    USER_FIELD = 'user'
+
+    def update_counter(self, data, delta):
+        if self.COUNTER is None:
+            return
+        model, field, counter = self.COUNTER
+        update_counter(model, getattr(data[field], 'pk', data[field]),
+                       counter, delta)
 
+    @transaction.atomic
     def create(self, validated_data):
         try:
             self.instance = self.Meta.model.objects.create(**validated_data)
         except IntegrityError:
             raise serializers.ValidationError(
                 {'errors': self.ERRORS_TEXT.get('create')})
+        self.update_counter(validated_data, 1)
         return self.instance
 
+    @transaction.atomic
     def delete(self, validated_data):
-        try:
-            instance = self.Meta.model.objects.get(**validated_data)
-        except self.Meta.model.DoesNotExist:
+        deleted, _ = self.Meta.model.objects.filter(**validated_data).delete()
+        if not deleted:
             raise serializers.ValidationError(
                 {'errors': self.ERRORS_TEXT.get('delete')})
-        instance.delete()
+        self.update_counter(validated_data, -1)
         return None
 
     def to_representation(self, instance):
         return RecipeShortGetSerializer(instance=instance.recipe).data
 
+    def bulk_fields(self):
+        """Поле пользователя и поле связанного объекта."""
+        user_field = self.USER_FIELD
+        target_field, = (field for field in self.Meta.fields
+                         if field != user_field)
+        return user_field, target_field
+
+    def bulk_errors(self, user_id, objects):
+        return {}
+
+    def bulk_changed(self, user_id, pks, delta):
+        if not pks:
+            return
+        if self.COUNTER is not None:
+            model, _, counter = self.COUNTER
+            update_counters(model, pks, counter, delta)
+
+    @transaction.atomic
+    def bulk_create(self, user_id, pks):
+        """
+        Связи с несколькими объектами: id проверяются одним запросом,
+        новые строки вставляются одним bulk_create.
+        Возвращает созданные объекты и ошибки {id: текст}.
+        """
+        user_field, target_field = self.bulk_fields()
+        model = self.Meta.model
+        objects = model._meta.get_field(
+            target_field).related_model.objects.in_bulk(pks)
+        errors = {pk: self.ERRORS_TEXT['not_found']
+                  for pk in pks if pk not in objects}
+        errors.update(self.bulk_errors(user_id, objects))
+        created = [pk for pk in objects if pk not in errors]
+        # Без ignore_conflicts: счётчики меняются только для строк,
+        # которые вставлены этим запросом. Если параллельный запрос
+        # успел вставить часть связей, они читаются заново.
+        while True:
+            errors.update(
+                (pk, self.ERRORS_TEXT.get('create'))
+                for pk in model.objects.filter(**{
+                    user_field: user_id, f'{target_field}__in': created
+                }).values_list(f'{target_field}_id', flat=True))
+            created = [pk for pk in pks if pk not in errors]
+            try:
+                with transaction.atomic():
+                    model.objects.bulk_create(
+                        [model(**{f'{user_field}_id': user_id,
+                                  f'{target_field}_id': pk})
+                         for pk in created])
+                break
+            except IntegrityError:
+                if not model.objects.filter(**{
+                        user_field: user_id, f'{target_field}__in': created
+                }).exists():
+                    raise
+        self.bulk_changed(user_id, created, 1)
+        return [objects[pk] for pk in created], errors
+
+    @transaction.atomic
+    def bulk_delete(self, user_id, pks):
+        """Удаляет связи одним DELETE. Возвращает удалённые id и ошибки."""
+        user_field, target_field = self.bulk_fields()
+        queryset = self.Meta.model.objects.filter(**{
+            user_field: user_id, f'{target_field}__in': pks})
+        # Блокировка: параллельное удаление тех же связей дождётся
+        # коммита и не найдёт их, счётчики не уменьшатся дважды
+        existing = set(queryset.select_for_update().values_list(
+            f'{target_field}_id', flat=True))
+        queryset.delete()
+        deleted = [pk for pk in pks if pk in existing]
+        self.bulk_changed(user_id, deleted, -1)
+        return deleted, {pk: self.ERRORS_TEXT.get('delete')
+                         for pk in pks if pk not in existing}
+
+    def bulk_representation(self, objects):
+        return RecipeShortGetSerializer(objects, many=True,
+                                        context=self.context).data
+
+
+class BulkIdsSerializer(serializers.Serializer):
+    """Список id для пакетных операций."""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_MAX_IDS)
+
+    @staticmethod
+    def validate_ids(ids):
+        return list(dict.fromkeys(ids))
+
 
 class FavoriteCreateSerializer(FavoriteSerializer):
     """Сериализатор добавления избранного"""
     ERRORS_TEXT = {
+        **FavoriteSerializer.ERRORS_TEXT,
         'create': 'Рецепт уже в избранном.',
         'delete': 'Невозможно убрать рецепт. Рецепта нет в избранном.'
     }
+    COUNTER = (Recipe, 'recipe', 'favorites_count')
 
     class Meta:
         model = Favorites
@@ -353,6 +650,7 @@ class FavoriteCreateSerializer(FavoriteSerializer):
 class ShoppingCreateSerializer(FavoriteSerializer):
     """Сериализатор списка покупок"""
     ERRORS_TEXT = {
+        **FavoriteSerializer.ERRORS_TEXT,
         'create': 'Рецепт уже в списке покупок.',
         'delete': 'Невозможно убрать рецепт. Рецепта нет в списке покупок.'
     }
@@ -361,14 +659,39 @@ class ShoppingCreateSerializer(FavoriteSerializer):
         model = Carts
         fields = ('user', 'recipe')
 
+    @transaction.atomic
+    def create(self, validated_data):
+        instance = super().create(validated_data)
+        ShoppingListItem.objects.add_recipe((instance.user_id,),
+                                            instance.recipe_id)
+        return instance
+
+    @transaction.atomic
+    def delete(self, validated_data):
+        super().delete(validated_data)
+        ShoppingListItem.objects.remove_recipe((validated_data['user'],),
+                                               validated_data['recipe'])
+
+    def bulk_changed(self, user_id, pks, delta):
+        super().bulk_changed(user_id, pks, delta)
+        if not pks:
+            return
+        if delta > 0:
+            ShoppingListItem.objects.add_recipes((user_id,), pks)
+        else:
+            ShoppingListItem.objects.remove_recipes((user_id,), pks)
+
 
 class SubscriptionCreateSerializer(FavoriteSerializer):
     """Сериализатор подписок"""
     ERRORS_TEXT = {
+        **FavoriteSerializer.ERRORS_TEXT,
         'create': 'Вы уже подписаны на этого пользователя.',
         'delete': 'Вы не были подписаны на этого автора.',
         'validate': 'Нельзя подписаться на самого себя.',
     }
+    COUNTER = (User, 'author', 'followers_count')
+    USER_FIELD = 'subscriber'
 
     class Meta:
         model = Subscriptions
@@ -380,5 +703,35 @@ class SubscriptionCreateSerializer(FavoriteSerializer):
                 {'error': self.ERRORS_TEXT.get('validate')})
         return attrs
 
+    @transaction.atomic
+    def create(self, validated_data):
+        instance = super().create(validated_data)
+        FeedEntry.objects.subscribe(instance.subscriber, instance.author)
+        return instance
+
+    @transaction.atomic
+    def delete(self, validated_data):
+        super().delete(validated_data)
+        FeedEntry.objects.unsubscribe(validated_data['subscriber'],
+                                      validated_data['author'])
+
+    def bulk_errors(self, user_id, objects):
+        if user_id in objects:
+            return {user_id: self.ERRORS_TEXT.get('validate')}
+        return {}
+
+    def bulk_changed(self, user_id, pks, delta):
+        super().bulk_changed(user_id, pks, delta)
+        if not pks:
+            return
+        if delta < 0:
+            FeedEntry.objects.unsubscribe(user_id, *pks)
+            return
+        FeedEntry.objects.subscribe(user_id, *User.objects.filter(pk__in=pks))
+
+    def bulk_representation(self, objects):
+        return SubscriberGetSerializer(objects, many=True,
+                                       context=self.context).data
+
     def to_representation(self, instance):
         return SubscriberGetSerializer(instance=instance.author).data
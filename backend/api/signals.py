@@ -0,0 +1,129 @@
+from django.core.management.color import no_style
+from django.db import DatabaseError, connections, transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_migrate,
+                                      post_save)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipe.models import Ingredient, IngredientAmount, Recipe, Tag
+from users.models import User
+
+from . import authentication, documents, search
+from .cache import bump_version
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_reference_data(sender, **kwargs):
+    bump_version(sender)
+
+
+@receiver(post_migrate)
+def create_trigram_index(sender, using, **kwargs):
+    """
+    Триграммный индекс для поиска ингредиентов по подстроке в PostgreSQL.
+    Строится по UPPER(name), как в запросах istartswith/icontains.
+    """
+    connection = connections[using]
+    if sender.name != 'recipe' or connection.vendor != 'postgresql':
+        return
+    try:
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS recipe_ingredient_name_trgm '
+                'ON recipe_ingredient USING gin '
+                '(UPPER(name::text) gin_trgm_ops)')
+    except DatabaseError:
+        pass
+
+
+@receiver(post_migrate)
+def create_search_index(sender, using, **kwargs):
+    if sender.name == 'recipe':
+        search.create_index(using)
+
+
+@receiver(post_migrate)
+def reset_ingredient_amount_sequence(sender, using, **kwargs):
+    """
+    Раньше id ингредиентов рецепта задавались явно как latest('id') + 1,
+    и последовательность PostgreSQL от них отстаёт. Сдвигаем её за
+    наибольший id, чтобы новые строки не занимали существующие id.
+    """
+    if sender.name != 'recipe':
+        return
+    connection = connections[using]
+    statements = connection.ops.sequence_reset_sql(
+        no_style(), [IngredientAmount])
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+@receiver(post_save, sender=Recipe)
+def index_recipe(sender, instance, using, update_fields=None, **kwargs):
+    if update_fields is None or {'name', 'text'} & set(update_fields):
+        search.index_recipe(instance, using)
+
+
+@receiver(post_delete, sender=Recipe)
+def unindex_recipe(sender, instance, using, **kwargs):
+    search.unindex_recipe(instance, using)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    transaction.on_commit(lambda: authentication.invalidate(instance.key))
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, **kwargs):
+    if not created:
+        authentication.invalidate_user(instance.id)
+
+
+@receiver(post_save, sender=Recipe)
+def invalidate_recipe_document(sender, instance, **kwargs):
+    documents.invalidate(instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_document(sender, instance, **kwargs):
+    documents.remove(instance.pk)
+
+
+@receiver(post_save, sender=IngredientAmount)
+@receiver(post_delete, sender=IngredientAmount)
+def invalidate_ingredients_document(sender, instance, **kwargs):
+    documents.invalidate(instance.recipe_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_tags_document(sender, instance, action, reverse, pk_set,
+                             **kwargs):
+    if reverse and action == 'pre_clear':
+        # После clear у тега уже нет рецептов: id читаются до него
+        instance._cleared_recipe_ids = list(
+            instance.recipes.values_list('id', flat=True))
+        return
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        documents.invalidate(instance.pk)
+    elif action == 'post_clear':
+        documents.invalidate(*instance.__dict__.pop('_cleared_recipe_ids',
+                                                    ()))
+    else:
+        documents.invalidate(*pk_set)
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_documents(sender, instance, created, update_fields,
+                                **kwargs):
+    if created or (update_fields is not None
+                   and not set(documents.AUTHOR_FIELDS) & set(update_fields)):
+        return
+    documents.invalidate_author(instance.id)
@@ -0,0 +1,640 @@
+import base64
+import datetime
+import threading
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.cache import caches
+from django.core.handlers.asgi import ASGIHandler
+from django.core.signals import request_finished, request_started
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connection
+from django.test import (TestCase, TransactionTestCase,
+                         override_settings, skipUnlessDBFeature)
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipe.models import (FeedEntry, Ingredient, IngredientAmount, Recipe,
+                           ShoppingListItem, Tag)
+from users.models import User
+
+from . import documents, signals
+from .cache import bump_version
+
+
+def clear_caches():
+    for alias in ('default', 'local'):
+        caches[alias].clear()
+
+
+class RecipeListQueriesTest(TestCase):
+    """Число запросов списка рецептов не зависит от размера страницы."""
+    # COUNT, страница с флагами, рецепты с авторами, ингредиенты, теги
+    LIST_QUERIES = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Имя', last_name='Фамилия')
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Имя', last_name='Фамилия')
+        Tag.objects.bulk_create(
+            Tag(name=f'тег {i}', color=f'#00000{i}', slug=f'tag{i}')
+            for i in range(3))
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(5))
+        Recipe.objects.bulk_create(
+            Recipe(author=author, name=f'рецепт {i}', text='текст',
+                   cooking_time=10, image='recipe_images/test.jpg')
+            for i in range(100))
+        tags, ingredients = Tag.objects.all(), Ingredient.objects.all()
+        recipes = Recipe.objects.all()
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(recipe=recipe, ingredient=ingredient, amount=1)
+            for recipe in recipes for ingredient in ingredients)
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag=tag)
+            for recipe in recipes for tag in tags)
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_list_queries(self):
+        for size in (1, 10, 100):
+            with self.subTest(size=size):
+                clear_caches()
+                with self.assertNumQueries(self.LIST_QUERIES):
+                    response = self.client.get('/api/recipes/',
+                                               {'limit': size})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), size)
+                self.assertEqual(
+                    len(response.data['results'][0]['ingredients']), 5)
+
+    def test_flags_follow_writes(self):
+        recipe = Recipe.objects.first()
+        url = f'/api/recipes/{recipe.pk}/'
+        flags = ('is_favorited', 'is_in_shopping_cart')
+        response = self.client.get(url)
+        self.assertEqual([response.data[flag] for flag in flags],
+                         [False, False])
+        self.assertFalse(response.data['author']['is_subscribed'])
+        self.client.post(f'{url}favorite/')
+        self.client.post(f'{url}shopping_cart/')
+        self.client.post(f'/api/users/{recipe.author_id}/subscribe/')
+        response = self.client.get('/api/recipes/', {'limit': 100})
+        recipes = {item['id']: item for item in response.data['results']}
+        self.assertEqual([recipes[recipe.pk][flag] for flag in flags],
+                         [True, True])
+        self.assertTrue(recipes[recipe.pk]['author']['is_subscribed'])
+        self.client.delete(f'{url}favorite/')
+        self.assertFalse(self.client.get(url).data['is_favorited'])
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class RecipeConcurrentWritesTest(TransactionTestCase):
+    """Параллельные создания и изменения рецептов одного автора."""
+    IMAGE = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAA'
+             'fFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg==')
+
+    def setUp(self):
+        clear_caches()
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Имя', last_name='Фамилия')
+        self.readers = [
+            User.objects.create_user(
+                username=f'reader{i}', email=f'reader{i}@example.com',
+                first_name='Имя', last_name='Фамилия')
+            for i in range(3)]
+        self.tag = Tag.objects.create(name='тег', color='#000000',
+                                      slug='tag')
+        self.ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(5)]
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='общий рецепт', text='текст',
+            cooking_time=10, image='recipe_images/test.jpg')
+        self.recipe.tags.add(self.tag)
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(recipe=self.recipe, ingredient=ingredient,
+                             amount=1)
+            for ingredient in self.ingredients)
+
+    def amounts(self, amount, count=5):
+        return {ingredient.id: amount + index for index, ingredient
+                in enumerate(self.ingredients[:count])}
+
+    @staticmethod
+    def ingredients_data(amounts):
+        return [{'id': pk, 'amount': amount}
+                for pk, amount in amounts.items()]
+
+    @staticmethod
+    def run_parallel(requests):
+        """Запускает запросы (пользователь, метод, адрес, данные) разом."""
+        barrier = threading.Barrier(len(requests))
+        responses = [None] * len(requests)
+
+        def worker(index, user, method, url, data):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                barrier.wait()
+                responses[index] = getattr(client, method)(
+                    url, data, format='json')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(index, *request))
+                   for index, request in enumerate(requests)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def test_parallel_creates_and_updates(self):
+        url = f'/api/recipes/{self.recipe.pk}/'
+        created = {f'рецепт {i}': self.amounts(i + 1) for i in range(4)}
+        updates = [self.amounts(10 * (i + 1), count=3 + i % 3)
+                   for i in range(4)]
+        requests = [
+            *((self.author, 'post', '/api/recipes/', {
+                'ingredients': self.ingredients_data(amounts),
+                'tags': [self.tag.id], 'name': name, 'image': self.IMAGE,
+                'text': 'текст', 'cooking_time': 5,
+            }) for name, amounts in created.items()),
+            *((self.author, 'patch', url, {
+                'ingredients': self.ingredients_data(amounts),
+            }) for amounts in updates),
+            *((reader, 'post', f'{url}shopping_cart/', None)
+              for reader in self.readers),
+        ]
+        with mock.patch('api.serializers.images.schedule'):
+            responses = self.run_parallel(requests)
+
+        self.assertEqual([response.status_code for response in responses],
+                         [201] * 4 + [200] * 4 + [201] * 3)
+        for name, amounts in created.items():
+            recipe = Recipe.objects.get(author=self.author, name=name)
+            self.assertEqual(dict(recipe.ingredient_list.values_list(
+                'ingredient_id', 'amount')), amounts)
+        shared = dict(self.recipe.ingredient_list.values_list(
+            'ingredient_id', 'amount'))
+        self.assertIn(shared, updates)
+        for reader in self.readers:
+            items = dict(ShoppingListItem.objects.filter(
+                user=reader).values_list('ingredient_id', 'total_amount'))
+            expected = {
+                row['ingredient']: row['total']
+                for row in ShoppingListItem.objects.aggregate([reader])}
+            self.assertEqual(items, expected)
+            self.assertEqual(items, shared)
+
+
+class RecipeWritesTest(TestCase):
+    """Создание и изменение рецептов на любой БД."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Имя', last_name='Фамилия')
+        cls.tag = Tag.objects.create(name='тег', color='#000000', slug='tag')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(3)]
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='рецепт', text='текст',
+            cooking_time=10, image='recipe_images/test.jpg')
+        # Явные id без сдвига последовательности, как их выдавал
+        # latest('id') + 1: следующие значения последовательности заняты
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(id=index + 1, recipe=cls.recipe,
+                             ingredient=ingredient, amount=1)
+            for index, ingredient in enumerate(cls.ingredients))
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def test_create_and_update_after_rows_with_explicit_ids(self):
+        # Как migrate при обновлении
+        signals.reset_ingredient_amount_sequence(
+            sender=apps.get_app_config('recipe'), using=DEFAULT_DB_ALIAS)
+        amounts = {ingredient.id: 10 + index
+                   for index, ingredient in enumerate(self.ingredients)}
+        data = {
+            'ingredients': [{'id': pk, 'amount': amount}
+                            for pk, amount in amounts.items()],
+            'tags': [self.tag.id], 'image': RecipeConcurrentWritesTest.IMAGE,
+            'text': 'текст', 'cooking_time': 5,
+        }
+        with mock.patch('api.serializers.images.schedule'):
+            for name in ('первый', 'второй'):
+                response = self.client.post(
+                    '/api/recipes/', {**data, 'name': name}, format='json')
+                self.assertEqual(response.status_code, 201)
+                recipe = Recipe.objects.get(pk=response.data['id'])
+                self.assertEqual(dict(recipe.ingredient_list.values_list(
+                    'ingredient_id', 'amount')), amounts)
+            response = self.client.patch(
+                f'/api/recipes/{self.recipe.pk}/',
+                {'ingredients': data['ingredients']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(dict(self.recipe.ingredient_list.values_list(
+            'ingredient_id', 'amount')), amounts)
+
+    def test_broken_image_is_rejected(self):
+        image = base64.b64decode(
+            RecipeConcurrentWritesTest.IMAGE.split(',')[1])
+        data = {
+            'ingredients': [{'id': self.ingredients[0].id, 'amount': 1}],
+            'tags': [self.tag.id], 'name': 'рецепт', 'text': 'текст',
+            'cooking_time': 5,
+        }
+        broken = {
+            'garbage': image[:8] + b'garbage' * 10,
+            'truncated': image[:-5],
+            'bmp': b'BM' + image,
+        }
+        for name, content in broken.items():
+            with self.subTest(image=name):
+                encoded = base64.b64encode(content).decode()
+                response = self.client.post('/api/recipes/', {
+                    **data, 'image': f'data:image/png;base64,{encoded}'
+                }, format='json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('image', response.data)
+
+
+class BulkRelationsTest(TestCase):
+    """Пакетное добавление и удаление избранного, покупок и подписок."""
+    MISSING = 9999
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Имя', last_name='Фамилия')
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Имя', last_name='Фамилия')
+        ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(3)]
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.author, name=f'рецепт {i}', text='текст',
+                cooking_time=10, image='recipe_images/test.jpg')
+            for i in range(3)]
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(recipe=recipe, ingredient=ingredient,
+                             amount=10 * (index + 1) + position)
+            for index, recipe in enumerate(cls.recipes)
+            for position, ingredient in enumerate(ingredients[:index + 2]))
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def bulk(self, method, url, ids):
+        response = getattr(self.client, method)(url, {'ids': ids},
+                                                format='json')
+        statuses = {item['id']: item.get('status', 'error')
+                    for item in response.data['results']}
+        self.assertEqual(list(statuses), list(dict.fromkeys(ids)))
+        return response, statuses
+
+    def favorites_counts(self):
+        return [Recipe.objects.get(pk=recipe.pk).favorites_count
+                for recipe in self.recipes]
+
+    def shopping_list(self):
+        return dict(ShoppingListItem.objects.filter(
+            user=self.user).values_list('ingredient_id', 'total_amount'))
+
+    def expected_shopping_list(self, *recipes):
+        totals = {}
+        for pk, amount in IngredientAmount.objects.filter(
+                recipe__in=recipes).values_list('ingredient_id', 'amount'):
+            totals[pk] = totals.get(pk, 0) + amount
+        return totals
+
+    def test_mixed_ids(self):
+        first, second, third = (recipe.pk for recipe in self.recipes)
+        url = '/api/recipes/favorite/'
+        self.client.post(f'/api/recipes/{first}/favorite/')
+        response, statuses = self.bulk(
+            'post', url, [first, self.MISSING, second, second])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(statuses, {first: 'error', self.MISSING: 'error',
+                                    second: 'created'})
+        self.assertEqual(response.data['results'][2]['data']['id'], second)
+        self.assertEqual(self.favorites_counts(), [1, 1, 0])
+
+        response, statuses = self.bulk(
+            'delete', url, [first, third, self.MISSING])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(statuses, {first: 'deleted', third: 'error',
+                                    self.MISSING: 'error'})
+        self.assertEqual(self.favorites_counts(), [0, 1, 0])
+
+    def test_all_failed(self):
+        url = '/api/recipes/favorite/'
+        self.client.post(f'/api/recipes/{self.recipes[0].pk}/favorite/')
+        for method, ids in (('post', [self.recipes[0].pk, self.MISSING]),
+                            ('delete', [self.recipes[1].pk, self.MISSING])):
+            with self.subTest(method=method):
+                response, statuses = self.bulk(method, url, ids)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(set(statuses.values()), {'error'})
+        self.assertEqual(self.favorites_counts(), [1, 0, 0])
+
+    def test_shopping_list_follows_bulk_changes(self):
+        url = '/api/recipes/shopping_cart/'
+        first, second, third = self.recipes
+        self.client.post(f'/api/recipes/{first.pk}/shopping_cart/')
+        response, _ = self.bulk('post', url, [first.pk, second.pk, third.pk])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.shopping_list(),
+                         self.expected_shopping_list(first, second, third))
+
+        response, _ = self.bulk('delete', url, [second.pk, self.MISSING])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.shopping_list(),
+                         self.expected_shopping_list(first, third))
+        self.bulk('delete', url, [first.pk, third.pk])
+        self.assertEqual(self.shopping_list(), {})
+
+    def test_subscriptions(self):
+        url = '/api/users/subscribe/'
+        response, statuses = self.bulk(
+            'post', url, [self.author.pk, self.user.pk, self.MISSING])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(statuses, {self.author.pk: 'created',
+                                    self.user.pk: 'error',
+                                    self.MISSING: 'error'})
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 1)
+        self.assertEqual(FeedEntry.objects.filter(user=self.user).count(),
+                         len(self.recipes))
+
+        response, statuses = self.bulk('delete', url, [self.author.pk])
+        self.assertEqual(response.status_code, 200)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 0)
+        self.assertFalse(FeedEntry.objects.filter(user=self.user).exists())
+
+
+class RecipeDocumentsTest(TransactionTestCase):
+    """Документы рецептов в общем кэше."""
+
+    def setUp(self):
+        clear_caches()
+        patcher = mock.patch('api.documents.is_shared', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Имя', last_name='Фамилия')
+        self.tag = Tag.objects.create(name='тег', color='#000000',
+                                      slug='tag')
+        self.recipe = Recipe.objects.create(
+            author=author, name='рецепт', text='текст', cooking_time=10,
+            image='recipe_images/test.jpg')
+        self.recipe.tags.add(self.tag)
+        IngredientAmount.objects.create(
+            recipe=self.recipe, amount=1, ingredient=Ingredient.objects.create(
+                name='ингредиент', measurement_unit='г'))
+        self.url = f'/api/recipes/{self.recipe.pk}/'
+
+    def is_cached(self):
+        return caches['default'].get(
+            documents.document_key(self.recipe.pk)) is not None
+
+    def test_process_cache_keeps_no_documents(self):
+        with mock.patch('api.documents.is_shared', return_value=False):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertFalse(self.is_cached())
+
+    def test_reverse_clear_invalidates_documents(self):
+        self.assertEqual(len(self.client.get(self.url).json()['tags']), 1)
+        self.assertTrue(self.is_cached())
+        self.tag.recipes.clear()
+        self.assertEqual(self.client.get(self.url).json()['tags'], [])
+
+    @override_settings(DATABASE_REPLICAS=['default'])
+    def test_replica_documents_are_not_cached(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertFalse(self.is_cached())
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.client.get(self.url)
+        self.assertTrue(self.is_cached())
+
+
+class ShoppingCartDownloadTest(TestCase):
+    """Выгрузка списка покупок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Имя', last_name='Фамилия')
+        cls.buyer = User.objects.create_user(
+            username='buyer', email='buyer@example.com',
+            first_name='Имя', last_name='Фамилия')
+        recipe = Recipe.objects.create(
+            author=cls.user, name='рецепт', text='текст', cooking_time=10,
+            image='recipe_images/test.jpg')
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(20))
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(recipe=recipe, ingredient=ingredient, amount=1)
+            for ingredient in Ingredient.objects.all())
+        client = APIClient()
+        client.force_authenticate(cls.buyer)
+        client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+        cls.token = Token.objects.create(user=cls.buyer)
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def asgi_get(self, path, query_string):
+        """
+        Запрос через ASGIHandler: в отличие от AsyncClient, он сам
+        перебирает потоковый ответ в цикле событий.
+        """
+        messages = []
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': path,
+            'query_string': query_string.encode(),
+            'headers': [(b'authorization',
+                         f'Token {self.token.key}'.encode())],
+        }
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        # Как тестовый клиент: соединение с БД принадлежит TestCase
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            async_to_sync(ASGIHandler())(scope, receive, send)
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+        return messages[0]['status'], b''.join(
+            message.get('body', b'') for message in messages[1:])
+
+    def test_asgi_download_is_complete(self):
+        url = '/api/recipes/download_shopping_cart/'
+        self.client.force_authenticate(self.buyer)
+        for file_format in ('txt', 'csv', 'pdf'):
+            with self.subTest(format=file_format):
+                expected = b''.join(self.client.get(
+                    url, {'format': file_format}).streaming_content)
+                status, content = self.asgi_get(
+                    url, f'format={file_format}')
+                self.assertEqual(status, 200)
+                if file_format == 'pdf':
+                    # В PDF есть время создания
+                    expected, content = len(expected), len(content)
+                self.assertEqual(content, expected)
+
+    def test_errors_are_json_for_any_format(self):
+        for file_format in ('txt', 'csv', 'pdf'):
+            with self.subTest(format=file_format):
+                response = self.client.get(
+                    '/api/recipes/download_shopping_cart/',
+                    {'format': file_format})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response['Content-Type'],
+                                 'application/json')
+                self.assertIn('В списке покупок нет рецептов.',
+                              response.json())
+
+
+class ReferenceDataVersionTest(TestCase):
+    """Изменения справочника из другого процесса видны без перезапуска."""
+
+    def setUp(self):
+        clear_caches()
+
+    @override_settings(VERSION_LOCAL_TTL=0)
+    def test_loader_changes_are_visible(self):
+        url = '/api/ingredients/'
+        response = self.client.get(url, {'name': 'огур'})
+        self.assertEqual(response.json(), [])
+        # Так загружает команда ingredients: в своём процессе и со своим
+        # кэшем, который веб-воркеру не виден
+        Ingredient.objects.bulk_create(
+            [Ingredient(name='огурец', measurement_unit='шт')])
+        with mock.patch('api.cache.cache', caches['local']):
+            bump_version(Ingredient)
+        response = self.client.get(url, {'name': 'огур'})
+        self.assertEqual([item['name'] for item in response.json()],
+                         ['огурец'])
+
+
+class FeedTest(TestCase):
+    """Лента подписок: порядок, курсор, авторы выше порога рассылки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Имя', last_name='Фамилия')
+        cls.authors = [
+            User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@example.com',
+                first_name='Имя', last_name='Фамилия')
+            for i in range(2)]
+        Recipe.objects.bulk_create(
+            Recipe(author=cls.authors[i % 2], name=f'рецепт {i}',
+                   text='текст', cooking_time=10,
+                   image='recipe_images/test.jpg')
+            for i in range(6))
+        # Рецепты опубликованы по очереди, часть - в одну и ту же секунду
+        start = timezone.now() - datetime.timedelta(days=1)
+        for i, recipe in enumerate(Recipe.objects.order_by('id')):
+            Recipe.objects.filter(pk=recipe.pk).update(
+                pub_date=start + datetime.timedelta(seconds=i // 2))
+        cls.expected = list(Recipe.objects.order_by(
+            '-pub_date', '-id').values_list('id', flat=True))
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def subscribe(self, *authors):
+        for author in authors:
+            response = self.client.post(f'/api/users/{author.pk}/subscribe/')
+            self.assertEqual(response.status_code, 201)
+
+    def read_feed(self, limit):
+        ids, url = [], f'/api/recipes/feed/?limit={limit}'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            url = response.data['next']
+            # Неполной может быть только последняя страница
+            if url:
+                self.assertEqual(len(response.data['results']), limit)
+            ids += [recipe['id'] for recipe in response.data['results']]
+        return ids
+
+    def test_order_and_cursor(self):
+        self.subscribe(*self.authors)
+        response = self.client.get('/api/recipes/feed/', {'limit': 4})
+        self.assertEqual([recipe['id'] for recipe in response.data['results']],
+                         self.expected[:4])
+        self.assertIsNotNone(response.data['next'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([recipe['id'] for recipe in response.data['results']],
+                         self.expected[4:])
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(self.read_feed(limit=1), self.expected)
+
+    def test_pulled_authors_are_not_duplicated(self):
+        self.subscribe(*self.authors)
+        self.assertEqual(FeedEntry.objects.filter(user=self.reader).count(),
+                         len(self.expected))
+        # Автор перешагнул порог после рассылки: его рецепты есть и в
+        # FeedEntry, и в прямом чтении из Recipe
+        User.objects.filter(pk=self.authors[0].pk).update(followers_count=2)
+        with override_settings(FEED_FANOUT_MAX_FOLLOWERS=1):
+            for limit in (1, 2, 4, 10):
+                with self.subTest(limit=limit):
+                    self.assertEqual(self.read_feed(limit), self.expected)
+
+    def test_unsubscribe_removes_recipes(self):
+        self.subscribe(*self.authors)
+        response = self.client.delete(
+            f'/api/users/{self.authors[0].pk}/subscribe/')
+        self.assertEqual(response.status_code, 204)
+        expected = list(Recipe.objects.filter(
+            author=self.authors[1]).order_by(
+            '-pub_date', '-id').values_list('id', flat=True))
+        self.assertEqual(self.read_feed(limit=10), expected)
+        self.assertFalse(FeedEntry.objects.filter(
+            user=self.reader, recipe__author=self.authors[0]).exists())
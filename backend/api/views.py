@@ -1,15 +1,22 @@
-from datetime import datetime
+import hashlib
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
+from django.core.cache import cache as django_cache
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import F
 from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 from rest_framework import (decorators, exceptions, mixins, response, status,
                             viewsets)
 
 from recipe import models as models_recipe
-from users import models as models_user
 
-from . import filters, paginators, permissions, serializers
+from . import (autocomplete, cache, exporters, filters, metrics, paginators,
+               permissions, relations, renderers, serializers)
+from .counters import update_counter
 
 User = get_user_model()
 
@@ -28,7 +35,107 @@ class PaginateResponse:
                                  status=status.HTTP_200_OK)
 
 
-class UserViewSet(PaginateResponse,
+class MemoizedObject:
+    """
+    Call get_object() once per request.
+    """
+    def get_object(self):
+        if not hasattr(self, '_object'):
+            self._object = super().get_object()
+        return self._object
+
+
+class BulkRelations:
+    """
+    Add/remove relations with several objects in one request.
+    """
+    def bulk_relations_response(self):
+        ids_serializer = serializers.BulkIdsSerializer(data=self.request.data)
+        ids_serializer.is_valid(raise_exception=True)
+        pks = ids_serializer.validated_data['ids']
+        serializer = self.get_serializer()
+        user_id = self.get_user().id
+        data = {}
+        if self.request.method == 'POST':
+            objects, errors = serializer.bulk_create(user_id, pks)
+            data = {obj.pk: item for obj, item in zip(
+                objects, serializer.bulk_representation(objects))}
+            result, code = 'created', status.HTTP_201_CREATED
+        else:
+            deleted, errors = serializer.bulk_delete(user_id, pks)
+            result, code = 'deleted', status.HTTP_200_OK
+        results = []
+        for pk in pks:
+            if pk in errors:
+                results.append({'id': pk, 'errors': errors[pk]})
+            elif pk in data:
+                results.append({'id': pk, 'status': result, 'data': data[pk]})
+            else:
+                results.append({'id': pk, 'status': result})
+        if len(errors) == len(pks):
+            code = status.HTTP_400_BAD_REQUEST
+        return response.Response(data={'results': results}, status=code)
+
+
+class CachedResponse:
+    """
+    Add a versioned response cache with ETag/Last-Modified support.
+    """
+    cache_models = ()
+
+    def get_cache_version(self):
+        return max(cache.get_versions(*self.cache_models),
+                   key=cache.version_timestamp)
+
+    def get_response_cache_key(self, request, version):
+        path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        return f'response:{self.basename}:{version}:{path}'
+
+    def cached_response(self, request, handler, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return handler(request, *args, **kwargs)
+        version = self.get_cache_version()
+        key = self.get_response_cache_key(request, version)
+        cached = django_cache.get(key)
+        if cached is None:
+            resp = handler(request, *args, **kwargs)
+            if resp.status_code != status.HTTP_200_OK:
+                return resp
+            resp = self.finalize_response(request, resp, *args, **kwargs)
+            content = resp.render().content
+            cached = {
+                'content': content,
+                'content_type': resp['Content-Type'],
+                'etag': quote_etag(hashlib.sha1(content).hexdigest()),
+                'last_modified': cache.version_timestamp(version),
+            }
+            django_cache.set(key, cached,
+                             timeout=settings.REFERENCE_DATA_TTL)
+
+        resp = get_conditional_response(
+            request,
+            etag=cached['etag'],
+            last_modified=int(cached['last_modified']),
+        )
+        if resp is None:
+            resp = HttpResponse(cached['content'],
+                                content_type=cached['content_type'])
+        resp['ETag'] = cached['etag']
+        resp['Last-Modified'] = http_date(cached['last_modified'])
+        patch_cache_control(resp, public=True, no_cache=True)
+        return resp
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve,
+                                    *args, **kwargs)
+
+
+class UserViewSet(MemoizedObject,
+                  BulkRelations,
+                  PaginateResponse,
                   mixins.CreateModelMixin,
                   mixins.RetrieveModelMixin,
                   mixins.ListModelMixin,
@@ -37,37 +144,25 @@ class UserViewSet(PaginateResponse,
     queryset = User.objects.all()
     permission_classes = (permissions.AllowAny,)
     pagination_class = paginators.Pagination
+    cursor_ordering = 'id'
 
     def get_serializer_class(self):
         if self.action in ('list', 'retrieve', 'me'):
             return serializers.UserSerializer
         elif self.action in ('create',):
             return serializers.UsersCreateSerializer
-        elif self.action in ('subscribe',):
+        elif self.action in ('subscribe', 'subscribe_bulk'):
             return serializers.SubscriptionCreateSerializer
         elif self.action in ('subscriptions',):
             return serializers.SubscriberGetSerializer
         elif self.action in ('set_password',):
             return serializers.UsersChangePasswordSerializer
 
-    def get_serializer_context(self):
-        context = super().get_serializer_context()
-        if self.request.user.is_anonymous or self.action not in ('list',
-                                                                 'retrieve'):
-            return context
-
-        data = {'subscriber': self.get_user()}
-        if self.kwargs:
-            data['author'] = self.get_object()
-
-        add_context_data = {
-            'subscribed_users': models_user.Subscriptions,
-        }
-        for name, model in add_context_data.items():
-            context[name] = set(
-                model.objects.filter(**data).values_list('author_id',
-                                                         flat=True))
-        return context
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in ('list', 'retrieve'):
+            return queryset
+        return relations.annotate_users(queryset, self.get_user())
 
     def get_user(self):
         return self.request.user
@@ -115,6 +210,14 @@ class UserViewSet(PaginateResponse,
         elif self.request.method == 'DELETE':
             return self._delete_subscribe(data)
 
+    @decorators.action(
+        methods=['post', 'delete'], detail=False, url_path='subscribe',
+        url_name='subscribe_bulk',
+        permission_classes=[permissions.IsAuthenticated]
+    )
+    def subscribe_bulk(self, request, *args, **kwargs):
+        return self.bulk_relations_response()
+
     def _create_subscribe(self, data):
         serializer = self.get_serializer(data=data)
         serializer.is_valid(raise_exception=True)
@@ -142,81 +245,108 @@ class UserViewSet(PaginateResponse,
         return self.paginate_response(subscribers)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(CachedResponse, viewsets.ReadOnlyModelViewSet):
     """Управление тегами"""
+    cache_models = (models_recipe.Tag,)
     queryset = models_recipe.Tag.objects.all()
     serializer_class = serializers.TagGetSerializer
     permission_classes = (permissions.AllowAny,)
     pagination_class = None
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(CachedResponse, viewsets.ReadOnlyModelViewSet):
     """Управление ингредиентами"""
+    cache_models = (models_recipe.Ingredient,)
     queryset = models_recipe.Ingredient.objects.all()
     serializer_class = serializers.IngredientGetSerializer
     permission_classes = (permissions.AllowAny,)
     pagination_class = None
     filterset_class = filters.IngredientFilter
+    search_limit = 20
+    max_search_limit = 100
 
+    def get_search_limit(self):
+        limit = self.request.query_params.get('limit', '')
+        if not limit.isdigit() or not int(limit):
+            return self.search_limit
+        return min(int(limit), self.max_search_limit)
 
-class RecipeViewSet(PaginateResponse, viewsets.ModelViewSet):
+    def list(self, request, *args, **kwargs):
+        if not request.query_params.get('name'):
+            return super().list(request, *args, **kwargs)
+        return self.cached_response(request, self.search, *args, **kwargs)
+
+    def search(self, request, *args, **kwargs):
+        return response.Response(
+            data=autocomplete.ingredient_index.search(
+                request.query_params['name'], self.get_search_limit()),
+            status=status.HTTP_200_OK)
+
+
+class RecipeViewSet(MemoizedObject, BulkRelations, PaginateResponse,
+                    viewsets.ModelViewSet):
     """Управление рецептами"""
     queryset = models_recipe.Recipe.objects.all()
     permission_classes = (permissions.AuthorOrAdmin,)
+    pagination_class = paginators.Pagination
+    cursor_ordering = ('-pub_date', '-id')
     filterset_class = filters.RecipeFilter
 
     def get_user(self):
         return self.request.user
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in ('list', 'retrieve', 'feed'):
+            return queryset
+        # Тела рецептов берутся из кэша документов, флаги из аннотаций
+        return relations.annotate_recipes(
+            queryset.only('id', 'author', 'pub_date'), self.get_user())
+
     def get_serializer_class(self):
-        if self.action in ('list', 'retrieve'):
+        if self.action in ('list', 'retrieve', 'feed'):
             return serializers.RecipeGetSerializer
         elif self.action in ('create', 'update', 'partial_update'):
             return serializers.RecipeCreateSerializer
-        elif self.action in ('favorite',):
+        elif self.action in ('favorite', 'favorite_bulk'):
             return serializers.FavoriteCreateSerializer
-        elif self.action in ('shopping_cart',):
+        elif self.action in ('shopping_cart', 'shopping_cart_bulk'):
             return serializers.ShoppingCreateSerializer
         elif self.action in ('download_shopping_cart',):
             return serializers.ShoppingCartDownloadSerializer
 
-    def get_serializer_context(self):
-        context = super().get_serializer_context()
-        if self.request.user.is_anonymous or self.action not in ('list',
-                                                                 'retrieve'):
-            return context
-
-        data = {'user': self.get_user()}
-        if self.kwargs:
-            data['recipe'] = self.get_object()
-
-        add_context_data = {
-            'favorite_recipes': models_recipe.Favorites,
-            'shopping_recipes': models_recipe.Carts
-        }
-        for name, model in add_context_data.items():
-            context[name] = set(model.objects.filter(**data).values_list(
-                'recipe_id', flat=True)
-                )
-
-        data = {
-            'subscriber': self.get_user(),
-        }
-        if self.kwargs:
-            data['author_id'] = self.get_object().author
-
-        context['subscribed_users'] = (
-            set(models_user.Subscriptions.objects.filter(**data).values_list(
-                'author_id', flat=True))
-            )
-        return context
-
     def perform_create(self, serializer):
         serializer.save(author=self.get_user())
 
     def perform_update(self, serializer):
         serializer.save(author=self.get_user())
 
+    def handle_exception(self, exc):
+        # Ошибки выгрузки - JSON, а не файл формата из параметра format
+        if getattr(self, 'action', None) == 'download_shopping_cart':
+            self.request.accepted_renderer = renderers.JSONRenderer()
+            self.request.accepted_media_type = (
+                renderers.JSONRenderer.media_type)
+        return super().handle_exception(exc)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        models_recipe.ShoppingListItem.objects.remove_recipe(
+            instance.shopping_cart.values_list('user_id', flat=True),
+            instance.id)
+        instance.delete()
+        update_counter(User, instance.author_id, 'recipes_count', -1)
+
+    @decorators.action(
+        methods=['get'], detail=False, url_path='feed', url_name='feed',
+        permission_classes=[permissions.IsAuthenticated],
+        pagination_class=paginators.TimelinePagination
+    )
+    def feed(self, request, *args, **kwargs):
+        timeline = models_recipe.FeedEntry.objects.timeline(
+            self.get_user(), self.filter_queryset(self.get_queryset()))
+        return self.paginate_response(timeline)
+
     @decorators.action(
         methods=['delete', 'post'],
         detail=True, url_path='favorite', url_name='favorite',
@@ -233,6 +363,22 @@ class RecipeViewSet(PaginateResponse, viewsets.ModelViewSet):
     def shopping_cart(self, request, *args, **kwargs):
         return self._favorite_or_shopping_cart_view()
 
+    @decorators.action(
+        methods=['delete', 'post'],
+        detail=False, url_path='favorite', url_name='favorite_bulk',
+        permission_classes=[permissions.IsAuthenticated]
+    )
+    def favorite_bulk(self, request, *args, **kwargs):
+        return self.bulk_relations_response()
+
+    @decorators.action(
+        methods=['delete', 'post'],
+        detail=False, url_path='shopping_cart', url_name='shopping_cart_bulk',
+        permission_classes=[permissions.IsAuthenticated]
+    )
+    def shopping_cart_bulk(self, request, *args, **kwargs):
+        return self.bulk_relations_response()
+
     def _favorite_or_shopping_cart_view(self):
         data = {
             'user': self.get_user().id,
@@ -258,39 +404,41 @@ class RecipeViewSet(PaginateResponse, viewsets.ModelViewSet):
     @decorators.action(
         methods=['get'], detail=False,
         url_path='download_shopping_cart', url_name='download_shopping_cart',
-        permission_classes=[permissions.IsAuthenticated]
+        permission_classes=[permissions.IsAuthenticated],
+        renderer_classes=renderers.SHOPPING_LIST_RENDERERS
     )
     def download_shopping_cart(self, request, *args, **kwargs):
         user = self.get_user()
         if not user.shopping_cart.exists():
             raise exceptions.ValidationError('В списке покупок нет рецептов.')
 
-        ingredients = models_recipe.IngredientAmount.objects.filter(
-            recipe__shopping_cart__user=user
+        ingredients = models_recipe.ShoppingListItem.objects.filter(
+            user=user
         ).values(
             'ingredient__name',
             'ingredient__measurement_unit'
-        ).annotate(amount=Sum('amount'))
+        ).annotate(amount=F('total_amount')).order_by(
+            'ingredient__name',
+            'ingredient__measurement_unit'
+        )
 
-        filename, shopping_list = self.create_shopping_list(ingredients)
+        exporter_class = exporters.EXPORTERS.get(
+            request.accepted_renderer.format, exporters.TxtExporter)
+        return exporter_class(
+            user, ingredients,
+            prefetch=isinstance(request._request, ASGIRequest)
+        ).get_response()
 
-        resp = HttpResponse(shopping_list, content_type='text/plain')
-        resp['Content-Disposition'] = f'attachment; filename={filename}'
-        return resp
 
-    def create_shopping_list(self, ingredients):
-        today = datetime.today()
-        user = self.get_user()
-        shopping_list = (
-            f'Список покупок для: {user.get_full_name()}\n'
-            f'Дата: {today:%Y-%m-%d}\n\n'
-        )
-        shopping_list += '\n'.join([
-            f'- {ingredient["ingredient__name"]} '
-            f'({ingredient["ingredient__measurement_unit"]})'
-            f' - {ingredient["amount"]}'
-            for ingredient in ingredients
-        ])
-        shopping_list += f'\n\nFoodgram ({today:%Y})'
-        filename = f'{user.username}_shopping_list.txt'
-        return filename, shopping_list
+class MetricsViewSet(viewsets.ViewSet):
+    """Замеры запросов по действиям API за последнее окно"""
+    permission_classes = (permissions.IsAdminUser,)
+
+    def list(self, request):
+        return response.Response(data=metrics.histogram.summary(),
+                                 status=status.HTTP_200_OK)
+
+    @decorators.action(methods=['post'], detail=False)
+    def reset(self, request):
+        metrics.histogram.clear()
+        return response.Response(status=status.HTTP_204_NO_CONTENT)
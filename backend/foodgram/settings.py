@@ -39,6 +39,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.replicas.ReplicaMiddleware',
+    'api.metrics.MetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
@@ -82,6 +84,31 @@ else:
         }
     }
 
+# Реплики для чтения через запятую: файлы SQLite или хосты PostgreSQL
+DATABASE_REPLICAS = []
+for index, replica in enumerate(
+        filter(None, os.getenv('DB_REPLICAS', '').split(',')), start=1):
+    field = ('NAME' if DATABASES['default']['ENGINE'].endswith('sqlite3')
+             else 'HOST')
+    DATABASES[f'replica_{index}'] = {
+        **DATABASES['default'], field: replica.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica_{index}')
+
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+REPLICA_PIN_SECONDS = 5
+REPLICA_ENDPOINTS = {
+    'RecipeViewSet.list',
+    'RecipeViewSet.retrieve',
+    'TagViewSet.list',
+    'TagViewSet.retrieve',
+    'IngredientViewSet.list',
+    'IngredientViewSet.retrieve',
+    'UserViewSet.list',
+    'UserViewSet.retrieve',
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': ('django.contrib.auth.password_validation.'
@@ -126,7 +153,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PAGINATION_CLASS': ('rest_framework.pagination.'
                                  'PageNumberPagination'),
@@ -156,6 +183,59 @@ DJOSER = {
     },
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'local',
+    },
+}
+# Общий для всех процессов кэш: адреса memcached через запятую
+MEMCACHED_LOCATION = os.getenv('MEMCACHED_LOCATION', '')
+if MEMCACHED_LOCATION:
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+        'LOCATION': MEMCACHED_LOCATION.split(','),
+    }
+
+TOKEN_CACHE_TTL = 30
+# Токены в кэше default имеют смысл, только если он общий
+TOKEN_CACHE_SHARED_TTL = 300 if MEMCACHED_LOCATION else None
+REFERENCE_DATA_TTL = 300
+# Как долго кэш процесса доверяет версии справочника без чтения из БД
+VERSION_LOCAL_TTL = 5
+RECIPE_DOCUMENT_TTL = 600
+BULK_MAX_IDS = 100
+
+FEED_FANOUT_MAX_FOLLOWERS = 10000
+FEED_FANOUT_BATCH_SIZE = 1000
+FEED_BACKFILL_SIZE = 20
+FEED_MAX_ENTRIES = 500
+
+IMAGE_WORKERS = 2
+# Сколько байт картинки декодируется и проверяется на запросе
+IMAGE_CHECK_SIZE = 3 * 1024 * 1024
+IMAGE_VARIANT_WIDTHS = (320, 640, 1280)
+IMAGE_THUMB_WIDTH = 320
+IMAGE_QUALITY = 80
+
+METRICS_WINDOW = 1000
+QUERY_BUDGET = None
+# Справочники учитывают чтение версий раз в VERSION_LOCAL_TTL
+QUERY_BUDGETS = {
+    'RecipeViewSet.list': 6,
+    'RecipeViewSet.retrieve': 5,
+    'RecipeViewSet.feed': 7,
+    'UserViewSet.list': 4,
+    'UserViewSet.retrieve': 4,
+    'UserViewSet.subscriptions': 5,
+    'TagViewSet.list': 3,
+    'IngredientViewSet.list': 3,
+}
+QUERY_BUDGET_STRICT = os.getenv('QUERY_BUDGET_STRICT', '') == '1'
+
 USER_EMAIL_FIELD_LENG = 254
 USER_CHAR_FIELD_LENG = 150
 RECIPE_CHAR_FIELD_LENG = 200
@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Carts, Favorites, Ingredient, IngredientAmount, Recipe, Tag
+from .models import (Carts, Favorites, Ingredient, IngredientAmount, Recipe,
+                     ShoppingListItem, Tag)
 
 
 class IngredientAdmin(admin.ModelAdmin):
@@ -33,7 +34,7 @@ class RecipeAdmin(admin.ModelAdmin):
 
     @admin.display(empty_value='Никто')
     def favorited(self, obj):
-        return Favorites.objects.filter(recipe=obj).count()
+        return obj.favorites_count
 
     favorited.short_description = 'Кол-во людей добавивших в избранное'
 
@@ -42,6 +43,11 @@ class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe')
 
 
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = ('user', 'ingredient', 'total_amount')
+    list_select_related = ('user', 'ingredient')
+
+
 class TagAdmin(admin.ModelAdmin):
     list_display = ('name', 'color', 'slug')
 
@@ -52,3 +58,4 @@ admin.site.register(Favorites, FavoriteAdmin)
 admin.site.register(Tag, TagAdmin)
 admin.site.register(Carts, ShoppingCartAdmin)
 admin.site.register(Recipe, RecipeAdmin)
+admin.site.register(ShoppingListItem, ShoppingListItemAdmin)
@@ -1,7 +1,11 @@
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.core import validators
-from django.db import models
+from django.db import connection, models
+from django.db.models import Case, F, Q, Sum, Value, When
+
+from users.models import Subscriptions
 
 User = get_user_model()
 
@@ -39,10 +43,12 @@ class IngredientAmount(models.Model):
     ingredient = models.ForeignKey(
         to=Ingredient,
         on_delete=models.CASCADE,
+        db_index=False,
         verbose_name='Ингредиенты, связанные с рецептом', )
     recipe = models.ForeignKey(
         to='Recipe',
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='ingredient_list',
         verbose_name='Рецепты, содержащие ингредиенты', )
 
@@ -55,6 +61,11 @@ class IngredientAmount(models.Model):
                 name='Unique_ingredient_in_recipe',
                 fields=['recipe', 'ingredient']),
         ]
+        indexes = [
+            models.Index(
+                fields=['ingredient', 'recipe'],
+                name='ingredient_recipe_idx'),
+        ]
 
     def __str__(self):
         return (f'{self.ingredient.name}'
@@ -87,17 +98,49 @@ class Tag(models.Model):
         return self.name
 
 
+class RecipeManager(models.Manager):
+
+    def latest_for_authors(self, author_ids, limit=None):
+        """
+        Последние рецепты каждого из авторов одним запросом:
+        ROW_NUMBER() OVER (PARTITION BY author) с отсечением по limit.
+        """
+        author_ids = list(author_ids)
+        if not author_ids:
+            return []
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        author = quote(self.model._meta.get_field('author').column)
+        sql = (
+            f'SELECT * FROM ('
+            f'SELECT *, ROW_NUMBER() OVER ('
+            f'PARTITION BY {author} '
+            f'ORDER BY {quote("pub_date")} DESC, {quote("id")} DESC'
+            f') AS {quote("row_number")} FROM {table} '
+            f'WHERE {author} IN ({", ".join(["%s"] * len(author_ids))})'
+            f') AS {quote("ranked")}'
+        )
+        params = author_ids
+        if limit is not None:
+            sql += f' WHERE {quote("row_number")} <= %s'
+            params = [*author_ids, limit]
+        sql += f' ORDER BY {author}, {quote("row_number")}'
+        return self.raw(sql, params)
+
+
 class Recipe(models.Model):
     """Модель таблицы списка рецептов."""
     name = models.CharField(
         verbose_name='Название рецепта',
         max_length=settings.RECIPE_CHAR_FIELD_LENG)
     text = models.TextField(verbose_name='Описание рецепта', )
+    # Отдельный индекс не нужен: author - начало recipe_author_pub_date_idx
     author = models.ForeignKey(
         to=User,
         on_delete=models.CASCADE,
         verbose_name='Автор рецепта',
-        related_name='recipes')
+        related_name='recipes',
+        db_index=False)
     cooking_time = models.PositiveSmallIntegerField(
         verbose_name='Время приготовления',
         validators=(
@@ -114,16 +157,45 @@ class Recipe(models.Model):
     image = models.ImageField(
         verbose_name='Изображение',
         upload_to='recipe_images/')
+    image_variants = models.JSONField(
+        verbose_name='Уменьшенные изображения',
+        default=dict,
+        blank=True,
+        editable=False)
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        editable=False)
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Кол-во добавлений в избранное',
+        default=0,
+        editable=False)
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+        auto_now_add=True)
+
+    objects = RecipeManager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        ordering = ('-pub_date', '-id')
         constraints = [
             models.UniqueConstraint(
                 fields=['author', 'name'],
                 name='unique_author_name'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipe_author_pub_date_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'Рецепт "{self.name}" от {self.author}'
@@ -134,12 +206,15 @@ class Favorites(models.Model):
         to=User,
         verbose_name='Пользователь',
         related_name='favorite',
-        on_delete=models.CASCADE
+        on_delete=models.CASCADE,
+        db_index=False
     )
+    # Отдельный индекс не нужен: recipe - начало favorite_recipe_user_idx
     recipe = models.ForeignKey(
         to=Recipe,
         verbose_name='Рецепт',
-        on_delete=models.CASCADE
+        on_delete=models.CASCADE,
+        db_index=False
     )
 
     class Meta:
@@ -152,6 +227,12 @@ class Favorites(models.Model):
                 name='unique_favorite'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['recipe', 'user'],
+                name='favorite_recipe_user_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.user} добавил {self.recipe} в избранное.'
@@ -162,13 +243,16 @@ class Carts(models.Model):
         to=User,
         verbose_name='Пользователь',
         related_name='shopping_cart',
-        on_delete=models.CASCADE
+        on_delete=models.CASCADE,
+        db_index=False
     )
+    # Отдельный индекс не нужен: recipe - начало cart_recipe_user_idx
     recipe = models.ForeignKey(
         to=Recipe,
         verbose_name='Рецепт',
         related_name='shopping_cart',
-        on_delete=models.CASCADE
+        on_delete=models.CASCADE,
+        db_index=False
     )
 
     class Meta:
@@ -181,6 +265,339 @@ class Carts(models.Model):
                 name='unique_cart'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['recipe', 'user'],
+                name='cart_recipe_user_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.user} добавил {self.recipe} в cписок покупок.'
+
+
+class ShoppingListItemManager(models.Manager):
+    """Инкрементальное обновление сводного списка покупок."""
+
+    @staticmethod
+    def recipe_amounts(recipe_id):
+        return dict(IngredientAmount.objects.filter(
+            recipe_id=recipe_id).values_list('ingredient_id', 'amount'))
+
+    def apply(self, user_ids, amounts):
+        """Прибавляет к спискам пользователей количества {ингредиент: +-n}."""
+        user_ids = list(user_ids)
+        amounts = {key: value for key, value in amounts.items() if value}
+        if not user_ids or not amounts:
+            return
+        self.bulk_create(
+            [self.model(user_id=user_id, ingredient_id=ingredient_id)
+             for user_id in user_ids for ingredient_id in amounts],
+            ignore_conflicts=True)
+        items = self.filter(user_id__in=user_ids, ingredient_id__in=amounts)
+        items.update(total_amount=F('total_amount') + Case(
+            *(When(ingredient_id=ingredient_id, then=Value(amount))
+              for ingredient_id, amount in amounts.items()),
+            default=Value(0),
+            output_field=models.IntegerField()))
+        items.filter(total_amount__lte=0).delete()
+
+    @staticmethod
+    def recipes_amounts(recipe_ids):
+        return dict(IngredientAmount.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values('ingredient_id').annotate(
+            total=Sum('amount')
+        ).values_list('ingredient_id', 'total').order_by())
+
+    @staticmethod
+    def lock_recipes(recipe_ids):
+        """
+        Блокирует рецепты до конца транзакции, как и изменение их
+        ингредиентов: количества читаются уже после чужого коммита.
+        """
+        list(Recipe.objects.select_for_update().filter(
+            pk__in=recipe_ids).order_by('pk').values_list('pk', flat=True))
+
+    def add_recipes(self, user_ids, recipe_ids):
+        self.lock_recipes(recipe_ids)
+        self.apply(user_ids, self.recipes_amounts(recipe_ids))
+
+    def remove_recipes(self, user_ids, recipe_ids):
+        self.lock_recipes(recipe_ids)
+        self.apply(user_ids, {
+            ingredient_id: -amount
+            for ingredient_id, amount in self.recipes_amounts(
+                recipe_ids).items()
+        })
+
+    def add_recipe(self, user_ids, recipe_id):
+        self.add_recipes(user_ids, (recipe_id,))
+
+    def remove_recipe(self, user_ids, recipe_id):
+        self.remove_recipes(user_ids, (recipe_id,))
+
+    def update_recipe(self, recipe_id, old_amounts, new_amounts=None):
+        """Переносит в списки изменение ингредиентов рецепта в корзинах."""
+        if new_amounts is None:
+            new_amounts = self.recipe_amounts(recipe_id)
+        self.apply(
+            Carts.objects.filter(recipe_id=recipe_id).values_list(
+                'user_id', flat=True),
+            {ingredient_id: (new_amounts.get(ingredient_id, 0)
+                             - old_amounts.get(ingredient_id, 0))
+             for ingredient_id in {*old_amounts, *new_amounts}})
+
+    @staticmethod
+    def aggregate(users=None):
+        """Эталонный расчёт списка по корзинам."""
+        # Одно условие на корзины: второй filter() добавил бы второе
+        # соединение с корзинами и умножил суммы на число их строк.
+        if users is None:
+            carts = {'recipe__shopping_cart__user__isnull': False}
+        else:
+            carts = {'recipe__shopping_cart__user__in': users}
+        return IngredientAmount.objects.filter(**carts).values(
+            'recipe__shopping_cart__user', 'ingredient'
+        ).annotate(total=Sum('amount')).order_by()
+
+    def rebuild(self, users=None, batch_size=1000):
+        items = self.all() if users is None else self.filter(user__in=users)
+        items.delete()
+        batch = []
+        for row in self.aggregate(users).iterator(chunk_size=batch_size):
+            batch.append(self.model(
+                user_id=row['recipe__shopping_cart__user'],
+                ingredient_id=row['ingredient'],
+                total_amount=row['total']))
+            if len(batch) >= batch_size:
+                self.bulk_create(batch)
+                batch = []
+        self.bulk_create(batch)
+
+
+class ShoppingListItem(models.Model):
+    """Сводный список покупок: сумма ингредиента по корзине пользователя."""
+    user = models.ForeignKey(
+        to=User,
+        verbose_name='Пользователь',
+        related_name='shopping_list',
+        on_delete=models.CASCADE,
+        db_index=False
+    )
+    ingredient = models.ForeignKey(
+        to=Ingredient,
+        verbose_name='Ингредиент',
+        on_delete=models.CASCADE
+    )
+    total_amount = models.IntegerField(
+        verbose_name='Количество',
+        default=0
+    )
+
+    objects = ShoppingListItemManager()
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Сводные списки покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return (f'{self.user}: {self.ingredient.name} '
+                f'{self.total_amount} {self.ingredient.measurement_unit}')
+
+
+class Timeline:
+    """
+    Лента пользователя по ключу (pub_date, id): диапазон индекса
+    (user, -pub_date, -recipe) по записям FeedEntry и последние рецепты
+    авторов, которых лента читает напрямую, по (author, -pub_date, -id).
+    recipes - queryset рецептов с фильтрами запроса.
+    """
+
+    def __init__(self, user, recipes):
+        self.user = user
+        self.recipes = recipes
+
+    @staticmethod
+    def after(position, date_field, id_field):
+        pub_date, pk = position
+        return (Q(**{f'{date_field}__lt': pub_date})
+                | Q(**{date_field: pub_date, f'{id_field}__lt': pk}))
+
+    def entries(self, position, limit):
+        entries = FeedEntry.objects.filter(user=self.user)
+        if self.recipes.query.has_filters():
+            entries = entries.filter(recipe__in=self.recipes.values('id'))
+        if position is not None:
+            entries = entries.filter(
+                self.after(position, 'pub_date', 'recipe_id'))
+        return list(entries.order_by('-pub_date', '-recipe_id').values_list(
+            'pub_date', 'recipe_id')[:limit])
+
+    def pulled(self, position, limit):
+        authors = list(Subscriptions.objects.filter(
+            subscriber=self.user,
+            author__followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS,
+        ).values_list('author_id', flat=True))
+        if not authors:
+            return []
+        recipes = self.recipes.filter(author__in=authors)
+        if position is not None:
+            recipes = recipes.filter(self.after(position, 'pub_date', 'id'))
+        return list(recipes.order_by('-pub_date', '-id').values_list(
+            'pub_date', 'id')[:limit])
+
+    def page(self, position, limit):
+        """Рецепты после позиции position, не больше limit."""
+        keys = sorted({*self.entries(position, limit),
+                       *self.pulled(position, limit)}, reverse=True)[:limit]
+        recipes = self.recipes.filter(
+            pk__in=[pk for _, pk in keys]).order_by()
+        recipes = {recipe.pk: recipe for recipe in recipes}
+        return [recipes[pk] for _, pk in keys if pk in recipes]
+
+
+class FeedEntryManager(models.Manager):
+    """Ленты подписок: рассылка рецептов подписчикам при публикации."""
+
+    def _bulk_create(self, entries):
+        batch_size = settings.FEED_FANOUT_BATCH_SIZE
+        batch = []
+        for entry in entries:
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                self.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        self.bulk_create(batch, ignore_conflicts=True)
+
+    @staticmethod
+    def is_pulled(author):
+        """Рецепты авторов с большим числом подписчиков читаются из Recipe."""
+        return author.followers_count > settings.FEED_FANOUT_MAX_FOLLOWERS
+
+    def fan_out(self, recipe):
+        if self.is_pulled(recipe.author):
+            return
+        followers = Subscriptions.objects.filter(
+            author_id=recipe.author_id
+        ).values_list('subscriber_id', flat=True).iterator(
+            chunk_size=settings.FEED_FANOUT_BATCH_SIZE)
+        self._bulk_create(self.model(user_id=follower_id, recipe=recipe,
+                                     pub_date=recipe.pub_date)
+                          for follower_id in followers)
+
+    def subscribe(self, user, *authors):
+        """Последние рецепты авторов в ленту подписчика."""
+        user_id = getattr(user, 'pk', user)
+        recipes = Recipe.objects.latest_for_authors(
+            (author.pk for author in authors if not self.is_pulled(author)),
+            settings.FEED_BACKFILL_SIZE)
+        self._bulk_create(self.model(user_id=user_id, recipe_id=recipe.pk,
+                                     pub_date=recipe.pub_date)
+                          for recipe in recipes)
+        self.trim((user_id,))
+
+    def unsubscribe(self, user, *authors):
+        self.filter(user=user, recipe__author__in=authors).delete()
+
+    def trim(self, user_ids=None):
+        """
+        Оставляет в лентах не больше FEED_MAX_ENTRIES последних записей.
+        Без user_ids обрезает ленты всех пользователей.
+        """
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        user = quote(self.model._meta.get_field('user').column)
+        recipe = quote(self.model._meta.get_field('recipe').column)
+        where, params = '', []
+        if user_ids is not None:
+            user_ids = list(user_ids)
+            if not user_ids:
+                return 0
+            where = f'WHERE {user} IN ({", ".join(["%s"] * len(user_ids))})'
+            params = user_ids
+        sql = (
+            f'DELETE FROM {table} WHERE {quote("id")} IN ('
+            f'SELECT {quote("id")} FROM ('
+            f'SELECT {quote("id")}, ROW_NUMBER() OVER ('
+            f'PARTITION BY {user} '
+            f'ORDER BY {quote("pub_date")} DESC, {recipe} DESC'
+            f') AS {quote("row_number")} FROM {table} {where}'
+            f') AS {quote("ranked")} WHERE {quote("row_number")} > %s)'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [*params, settings.FEED_MAX_ENTRIES])
+            return cursor.rowcount
+
+    def timeline(self, user, recipes):
+        return Timeline(user, recipes)
+
+
+class FeedEntry(models.Model):
+    """Запись ленты подписок пользователя."""
+    user = models.ForeignKey(
+        to=User,
+        verbose_name='Пользователь',
+        related_name='feed',
+        on_delete=models.CASCADE,
+        db_index=False
+    )
+    recipe = models.ForeignKey(
+        to=Recipe,
+        verbose_name='Рецепт',
+        related_name='feed_entries',
+        on_delete=models.CASCADE
+    )
+    # Копия Recipe.pub_date: ключ сортировки ленты
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации рецепта'
+    )
+
+    objects = FeedEntryManager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='feed_user_pub_date_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} в ленте {self.user}'
+
+
+class DataVersion(models.Model):
+    """
+    Версия справочника: общая для всех процессов, в том числе для команд
+    загрузки, даже если кэш у каждого процесса свой.
+    """
+    label = models.CharField(
+        verbose_name='Модель',
+        max_length=100,
+        primary_key=True
+    )
+    version = models.CharField(
+        verbose_name='Версия',
+        max_length=32
+    )
+
+    class Meta:
+        verbose_name = 'Версия справочника'
+        verbose_name_plural = 'Версии справочников'
+
+    def __str__(self):
+        return f'{self.label}: {self.version}'
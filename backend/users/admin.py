@@ -38,7 +38,8 @@ class UserAdmin(admin_auth.UserAdmin):
     add_form = UserCreationForm
 
     list_display = (
-        'username', 'email', 'first_name', 'last_name', 'is_staff'
+        'username', 'email', 'first_name', 'last_name', 'is_staff',
+        'recipes_count', 'followers_count'
     )
     list_filter = ('email', 'username')
     fieldsets = (
@@ -20,6 +20,14 @@ class User(AbstractUser):
         'Фамилия',
         max_length=settings.USER_CHAR_FIELD_LENG,
         blank=False)
+    recipes_count = models.PositiveIntegerField(
+        'Кол-во рецептов',
+        default=0,
+        editable=False)
+    followers_count = models.PositiveIntegerField(
+        'Кол-во подписчиков',
+        default=0,
+        editable=False)
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -36,12 +44,14 @@ class Subscriptions(models.Model):
         to=User,
         verbose_name='Автор рецепта',
         related_name='following',
-        on_delete=models.CASCADE,)
+        on_delete=models.CASCADE,
+        db_index=False,)
     subscriber = models.ForeignKey(
         to=User,
         verbose_name='Подписчики',
         related_name='subscriber',
-        on_delete=models.CASCADE,)
+        on_delete=models.CASCADE,
+        db_index=False,)
 
     class Meta:
         verbose_name = 'Подписка'
@@ -52,6 +62,12 @@ class Subscriptions(models.Model):
                 name='\nУже подписаны на этого пользователя!\n',
             ),
         )
+        indexes = (
+            models.Index(
+                fields=('subscriber', 'author'),
+                name='subscriber_author_idx',
+            ),
+        )
 
     def __str__(self):
         return f'{self.subscriber} подписан на {self.author}'